@@ -1,10 +1,21 @@
 from flask import Flask, render_template
 from config import configure_app
+import sys
+
+# `python app.py` runs this file as __main__; registering it as `app` as well keeps the modules that
+# `from app import app` on this same Flask instance instead of importing a second copy
+sys.modules.setdefault('app', sys.modules[__name__])
 
 app = Flask(__name__)
 configure_app(app)
+import metrics
 import routes
 import models
+import startup
+import commands
 
 if __name__ == '__main__':
+    # The development server sets up the database itself; deployments run `flask init-db` instead
+    with app.app_context():
+        startup.init_database()
     app.run(debug=True)
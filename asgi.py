@@ -0,0 +1,176 @@
+from app import app
+from models import db, USER_MODELS, REPLICA_KEYS, apply_sqlite_pragmas
+from config import is_sqlite_file
+from services import earliest_slots_query, SlotCollector
+from exports import EXPORTS, FORMATS, CHUNK_ROWS, export_scope, parse_date, header_chunk, rows_chunk
+from metrics import request_metrics, async_request_metrics, instrument_engine
+from passwords import hash_pool
+from a2wsgi import WSGIMiddleware
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine
+from itsdangerous import BadSignature
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs
+from itertools import count
+import re, time
+
+#ASGI entry point: read-heavy JSON and export routes run on an async engine, every other route on the Flask app in a thread pool
+ASYNC_DRIVERS = {'sqlite': 'sqlite+aiosqlite', 'postgresql': 'postgresql+asyncpg'}
+
+wsgi = WSGIMiddleware(app, workers = app.config['ASGI_THREADS'])
+async_engines = {}
+replica_turn = count()
+
+def create_async_engines():
+    # Mirrors the sync binds (primary and replicas) with async drivers; unsupported databases stay on the thread pool
+    with app.app_context():
+        for key, engine in db.engines.items():
+            driver = ASYNC_DRIVERS.get(engine.dialect.name)
+            if driver is None:
+                async_engines.clear()
+                return
+            options = {} if engine.dialect.name == 'sqlite' and not is_sqlite_file(str(engine.url)) else app.config['SQLALCHEMY_ENGINE_OPTIONS']
+            async_engine = create_async_engine(engine.url.set(drivername = driver), **options)
+            if is_sqlite_file(str(engine.url)):
+                apply_sqlite_pragmas(async_engine.sync_engine)
+            # Cursor events fire on the sync engine inside the request's task, so they count into its contextvar
+            instrument_engine(async_engine.sync_engine)
+            async_engines[key] = async_engine
+
+def flask_session(scope):
+    # Reads the signed Flask session cookie; anything missing or tampered with is an empty session
+    headers = dict(scope['headers'])
+    cookie = SimpleCookie(headers.get(b'cookie', b'').decode('latin-1')).get(app.config['SESSION_COOKIE_NAME'])
+    if cookie is None:
+        return {}
+    try:
+        return app.session_interface.get_signing_serializer(app).loads(
+            cookie.value, max_age = int(app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return {}
+
+def read_engine(user_session):
+    # Same policy as RoutingSession: replicas in turn, the primary inside the read-your-writes window
+    if REPLICA_KEYS and time.time() - user_session.get('last_write', 0) > app.config['REPLICA_STICKY_SECONDS']:
+        return async_engines[REPLICA_KEYS[next(replica_turn) % len(REPLICA_KEYS)]]
+    return async_engines[None]
+
+async def signed_in(conn, user_session):
+    model = USER_MODELS.get(user_session.get('role'))
+    if model is None or 'user_id' not in user_session:
+        return False
+    status = (await conn.execute(select(model.status).where(model.id == user_session['user_id']))).scalar()
+    return status == 'Active'
+
+async def send_response(send, status, content_type, body = None, headers = ()):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', content_type.encode())] + [(name.encode(), value.encode()) for name, value in headers]})
+    if body is not None:
+        await send({'type': 'http.response.body', 'body': body.encode()})
+
+async def earliest_slots(scope, send, args, user_session, id):
+    # The happy path of routes.earliest_slots; returning False hands the request to Flask for redirects and errors
+    visit_type = args.get('visit_type', 'In-Person')
+    try:
+        start, end = parse_date(args.get('from')), parse_date(args.get('to'))
+        limit = max(1, min(int(args.get('limit', 10)), app.config['MAX_PAGE_SIZE']))
+    except ValueError:
+        return False
+    if visit_type not in ['In-Person', 'Virtual']:
+        return False
+
+    async with read_engine(user_session).connect() as conn:
+        if not await signed_in(conn, user_session):
+            return False
+        collector = SlotCollector(limit)
+        result = await conn.stream(earliest_slots_query(int(id), start, end))
+        async for row in result:
+            if not collector.add(row):
+                break
+        await result.close()
+    slots = collector.result()
+
+    urls = app.url_map.bind('', script_name = scope.get('root_path') or None)
+    for slot in slots:
+        slot['selected_slot'] = f"{slot['schedule_id']}_{slot['slot']}"
+        slot['book_url'] = urls.build('book_appointment', {'doctor_id': slot['doctor_id']})
+    body = app.json.dumps({'department_id': int(id), 'visit_type': visit_type, 'slots': slots}, separators = (',', ':')) + '\n'
+    await send_response(send, 200, 'application/json', body)
+    return True
+
+async def export(scope, send, args, user_session, entity):
+    # The happy path of routes.export, streamed from a server-side cursor without holding a thread
+    format = args.get('format', 'csv')
+    if entity not in EXPORTS or format not in FORMATS:
+        return False
+    try:
+        date = parse_date(args.get('date'))
+        id = int(args['id']) if args.get('id') else None
+    except ValueError:
+        return False
+
+    async with read_engine(user_session).connect() as conn:
+        if not await signed_in(conn, user_session):
+            return False
+        export_filters = export_scope(entity, user_session['role'], user_session['user_id'], args.get('role'), id)
+        if export_filters is None:
+            return False
+        result = await conn.stream(EXPORTS[entity](*export_filters, date).execution_options(yield_per = CHUNK_ROWS))
+        columns = list(result.keys())
+        await send_response(send, 200, FORMATS[format], headers = [('content-disposition', f'attachment; filename={entity}.{format}')])
+        await send({'type': 'http.response.body', 'body': header_chunk(columns, format).encode(), 'more_body': True})
+        async for rows in result.partitions(CHUNK_ROWS):
+            await send({'type': 'http.response.body', 'body': rows_chunk(columns, rows, format).encode(), 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+    return True
+
+ASYNC_ROUTES = [
+    (re.compile(r'/department/(?P<id>\d+)/earliest_slots'), 'earliest_slots', earliest_slots),
+    (re.compile(r'/export/(?P<entity>\w+)'), 'export', export),
+]
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            create_async_engines()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            # The server has stopped accepting requests and drained in-flight ones by now
+            for engine in async_engines.values():
+                await engine.dispose()
+            hash_pool.executor.shutdown(wait = True)
+            wsgi.executor.shutdown(wait = True)
+            with app.app_context():
+                for engine in db.engines.values():
+                    engine.dispose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] == 'http' and scope['method'] == 'GET' and async_engines:
+        path = scope['path'][len(scope.get('root_path', '')):]
+        for pattern, endpoint, handler in ASYNC_ROUTES:
+            match = pattern.fullmatch(path)
+            if match:
+                args = {key: values[-1] for key, values in parse_qs(scope['query_string'].decode('latin-1')).items()}
+                start = time.perf_counter()
+                metrics = {'queries': 0, 'db': 0.0}
+                token = async_request_metrics.set(metrics)
+                try:
+                    handled = await handler(scope, send, args, flask_session(scope), **match.groupdict())
+                finally:
+                    async_request_metrics.reset(token)
+                if handled:
+                    # No templates are rendered on this path
+                    request_metrics.observe(endpoint, 'GET', 200, time.perf_counter() - start, metrics['queries'], metrics['db'], 0.0)
+                    return
+                break
+    await wsgi(scope, receive, send)
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run('asgi:application', host = '0.0.0.0', port = 8000, workers = app.config['ASGI_WORKERS'],
+                timeout_graceful_shutdown = app.config['ASGI_GRACEFUL_TIMEOUT'])
@@ -0,0 +1,178 @@
+from app import app
+from models import db, Admin, Department, Doctor, Patient, Appointment, Doctor_Schedule, Treatment
+from services import free_slots_filter
+from slots import SLOT_COUNT, iter_slots
+from synthetic import SYNTHETIC_PASSWORD
+from sqlalchemy import func
+from datetime import datetime, timezone
+from statistics import quantiles, mean
+import json, os, random, re, subprocess, sys, time
+
+#Benchmark harness: drives the real routes through the test client and reports latency percentiles and queries per request
+QUERIES = re.compile(r'desc="(\d+) queries"')
+# Run in a fresh interpreter: time to import the app, then to the first anonymous and first signed-in response
+STARTUP_PROBE = '''
+import json, time
+start = time.perf_counter()
+from app import app
+from models import Admin
+imported = time.perf_counter()
+client = app.test_client()
+client.get('/')
+first = time.perf_counter()
+with app.app_context():
+    admin = Admin.query.filter_by(status = 'Active').first()
+if admin:
+    with client.session_transaction() as session:
+        session.update(role = 'admin', user_id = admin.id, username = admin.username)
+    client.get('/admin_dashboard')
+signed_in = time.perf_counter()
+print(json.dumps({'import_ms': (imported - start) * 1000, 'first_response_ms': (first - imported) * 1000,
+                  'first_signed_in_response_ms': (signed_in - first) * 1000 if admin else None,
+                  'import_to_first_response_ms': (first - start) * 1000}))
+'''
+
+def pick_users(rng):
+    # A patient with history, an active doctor with upcoming schedules and an active admin
+    admin = Admin.query.filter_by(status = 'Active').order_by(Admin.id.asc()).first()
+    patient_id = db.session.query(Appointment.patient_id).order_by(Appointment.id.desc()).limit(1).scalar()
+    patient = db.session.get(Patient, patient_id) if patient_id else Patient.query.filter_by(status = 'Active').first()
+    doctor_ids = [id for id, in db.session.query(Doctor_Schedule.doctor_id).join(Doctor, Doctor.id == Doctor_Schedule.doctor_id).filter(
+        Doctor.status == 'Active', Doctor_Schedule.date >= datetime.now().date()).distinct().limit(100)]
+    doctor = db.session.get(Doctor, rng.choice(doctor_ids)) if doctor_ids else None
+    return admin, doctor, patient
+
+def free_slots(limit):
+    # Upcoming free (doctor, schedule, slot) triples for the booking scenario, each used once
+    rows = db.session.query(Doctor_Schedule.doctor_id, Doctor_Schedule.id, Doctor_Schedule.open_slots, Doctor_Schedule.booked_slots
+    ).join(Doctor, Doctor.id == Doctor_Schedule.doctor_id).filter(
+        Doctor.status == 'Active', Doctor_Schedule.date >= datetime.now().date(), Doctor_Schedule.status.is_(True), free_slots_filter()
+    ).order_by(Doctor_Schedule.date.asc()).limit(limit)
+    return [(doctor_id, schedule_id, slot) for doctor_id, schedule_id, open_slots, booked_slots in rows
+            for slot in iter_slots(open_slots & ~booked_slots)][:limit]
+
+def signed_in(role, user):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['role'] = role
+        session['user_id'] = user.id
+        session['username'] = user.username
+    return client
+
+def scenarios(rng, iterations):
+    admin, doctor, patient = pick_users(rng)
+    clients = {}
+    if admin:
+        clients['admin'] = signed_in('admin', admin)
+    if doctor:
+        clients['doctor'] = signed_in('doctor', doctor)
+    if patient:
+        clients['patient'] = signed_in('patient', patient)
+    names = [name for name, in db.session.query(Doctor.name).limit(200)] or ['a']
+    bookings = free_slots(iterations + 1)
+
+    plans = {}
+    if patient and patient.username.startswith('patient_'):
+        # Synthetic users share a known password; a fresh client per login keeps every attempt a real one
+        plans['login'] = (None, lambda: ('POST', '/login/patient', {'username': patient.username, 'password': SYNTHETIC_PASSWORD}))
+    if admin:
+        plans['admin_dashboard'] = ('admin', lambda: ('GET', '/admin_dashboard', None))
+        plans['admin_appointments'] = ('admin', lambda: ('GET', f'/admin/{admin.id}/appointments', None))
+        plans['departments'] = ('admin', lambda: ('GET', '/departments', None))
+    if doctor:
+        plans['doctor_dashboard'] = ('doctor', lambda: ('GET', '/doctor_dashboard', None))
+        schedule_ids = [id for id, in db.session.query(Doctor_Schedule.id).filter(
+            Doctor_Schedule.doctor_id == doctor.id, Doctor_Schedule.date >= datetime.now().date())]
+        # Opens every slot on every upcoming day, which never conflicts with existing bookings
+        form = {f'slot{n}-{id}': 'on' for id in schedule_ids for n in range(1, SLOT_COUNT + 1)}
+        plans['availability_update'] = ('doctor', lambda: ('POST', f'/doctor_id={doctor.id}/availability', form))
+    if patient:
+        plans['patient_dashboard'] = ('patient', lambda: ('GET', '/patient_dashboard', None))
+        plans['patient_appointments'] = ('patient', lambda: ('GET', f'/patient/{patient.id}/appointments', None))
+        plans['doctors'] = ('patient', lambda: ('GET', '/doctors', None))
+        plans['search'] = ('patient', lambda: ('GET', f'/search?category=doctor&query={rng.choice(names).split()[-1][:4]}', None))
+        if bookings:
+            def book():
+                doctor_id, schedule_id, slot = bookings.pop() if len(bookings) > 1 else bookings[0]
+                return ('POST', f'/appointment/book/{doctor_id}', {'patient_id': patient.id, 'selected_slot': f'{schedule_id}_{slot}',
+                                                                   'visit_type': 'In-Person'})
+            plans['booking'] = ('patient', book)
+    return clients, plans
+
+def measure(client, method, url, data):
+    start = time.perf_counter()
+    response = client.open(url, method = method, data = data)
+    elapsed = time.perf_counter() - start
+    match = QUERIES.search(response.headers.get('Server-Timing', ''))
+    # Form posts that fail validation redirect back to themselves
+    failed = response.status_code >= 400 or (method == 'POST' and response.location == url)
+    return elapsed, int(match.group(1)) if match else 0, failed
+
+def summarize(latencies, queries, errors):
+    cuts = quantiles(latencies, n = 100, method = 'inclusive') if len(latencies) > 1 else latencies * 99
+    return {'requests': len(latencies), 'errors': errors, 'mean_ms': round(mean(latencies) * 1000, 3),
+            'p50_ms': round(cuts[49] * 1000, 3), 'p95_ms': round(cuts[94] * 1000, 3), 'p99_ms': round(cuts[98] * 1000, 3),
+            'queries_per_request': round(mean(queries), 2)}
+
+def database_size():
+    return {model.__tablename__: db.session.query(func.count(model.id)).scalar()
+            for model in (Department, Doctor, Patient, Appointment, Treatment, Doctor_Schedule)}
+
+def run_benchmark(iterations = 100, seed = 1, only = None, progress = print):
+    rng = random.Random(seed)
+    server_timing = app.config['SERVER_TIMING']
+    app.config['SERVER_TIMING'] = True
+    try:
+        clients, plans = scenarios(rng, iterations)
+        results = {}
+        for name, (role, plan) in plans.items():
+            if only and name not in only:
+                continue
+            latencies, queries, errors = [], [], 0
+            # The first request warms caches and is not counted
+            for i in range(iterations + 1):
+                client = clients[role] if role else app.test_client()
+                elapsed, count, failed = measure(client, *plan())
+                if i == 0:
+                    continue
+                latencies.append(elapsed)
+                queries.append(count)
+                errors += failed
+            results[name] = summarize(latencies, queries, errors)
+            progress(f'{name}: p50 {results[name]["p50_ms"]} ms, p95 {results[name]["p95_ms"]} ms, '
+                     f'p99 {results[name]["p99_ms"]} ms, {results[name]["queries_per_request"]} queries/request')
+    finally:
+        app.config['SERVER_TIMING'] = server_timing
+    return {'timestamp': datetime.now(timezone.utc).isoformat(timespec = 'seconds'), 'iterations': iterations, 'seed': seed,
+            'database': db.engine.url.get_backend_name(), 'rows': database_size(), 'scenarios': results}
+
+def compare(current, baseline):
+    # Relative change of each percentile against an earlier run, for the scenarios both runs share
+    changes = {}
+    for name, result in current['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if before:
+            changes[name] = {key: round((result[key] - before[key]) / before[key] * 100, 1) if before[key] else None
+                             for key in ('p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request')}
+    return changes
+
+def run_startup_benchmark(runs = 5, environment = None, progress = print):
+    # Each run is a new process, so nothing is shared but what is on disk (bytecode caches, the database)
+    env = {**os.environ, **(environment or {})}
+    samples = []
+    for i in range(runs):
+        output = subprocess.run([sys.executable, '-c', STARTUP_PROBE], cwd = app.root_path, env = env,
+                                capture_output = True, text = True, check = True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+        progress(f'run {i + 1}: ' + ', '.join(f'{key} {value:.1f}' for key, value in samples[-1].items() if value is not None))
+    results = {}
+    for key in samples[0]:
+        values = sorted(sample[key] for sample in samples if sample[key] is not None)
+        if values:
+            results[key] = {'median': round(values[len(values) // 2], 1), 'min': round(values[0], 1), 'max': round(values[-1], 1)}
+    return {'timestamp': datetime.now(timezone.utc).isoformat(timespec = 'seconds'), 'runs': runs,
+            'environment': environment or {}, 'startup': results}
+
+def save_results(results, path):
+    with open(path, 'w') as file:
+        json.dump(results, file, indent = 2)
@@ -0,0 +1,55 @@
+from app import app
+from threading import Lock
+from collections import OrderedDict
+import time
+
+#Small in-process cache for reference data that only changes on admin actions
+class TTLCache:
+    # Bounded as well as timed: past size entries the least recently used one goes, so keys built from request
+    # input cannot grow a process without limit
+    def __init__(self, ttl, size = 1024):
+        self.ttl = ttl
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def get(self, key, loader):
+        # Keys are tuples whose first item names the group used for invalidation
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self.entries[key]
+            self.misses += 1
+        value = loader()
+        with self.lock:
+            self.entries[key] = (now + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last = False)
+        return value
+
+    def invalidate(self, *groups):
+        with self.lock:
+            for key in [key for key in self.entries if key[0] in groups]:
+                del self.entries[key]
+
+    def discard(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries), 'size': self.size, 'ttl': self.ttl}
+
+reference_cache = TTLCache(app.config['REFERENCE_CACHE_TTL'])
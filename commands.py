@@ -0,0 +1,143 @@
+import click, csv, json
+from app import app
+from models import db, REPLICA_KEYS
+from search import create_search_index
+from rollups import rebuild_rollups
+from exports import export_chunks, parse_date, EXPORTS, FORMATS
+from importer import import_users, read_records, IMPORT_MODELS
+from synthetic import generate
+from benchmark import run_benchmark, run_startup_benchmark, compare, save_results
+from startup import init_database, precompile_templates
+from services import sweep_outdated_entities, materialize_schedules, SCHEDULE_WINDOW_DAYS, AVAILABILITY_HORIZON_DAYS
+
+#Maintenance commands, run with `flask --app app <command>`
+@app.cli.command('init-db')
+def init_db():
+    """Create or migrate the schema, search indexes and rollups, and seed the default admin."""
+    result = init_database()
+    click.echo('Database initialised.' + (' Rollups rebuilt.' if result['rollups_rebuilt'] else '')
+               + (' Default admin created.' if result['admin_created'] else ''))
+
+@app.cli.command('precompile-templates')
+@click.option('--directory', default = None, help = 'Bytecode cache directory, TEMPLATE_CACHE_DIR by default.')
+def precompile_templates_command(directory):
+    """Compile every Jinja template into the bytecode cache, as a build step."""
+    directory = directory or app.config['TEMPLATE_CACHE_DIR']
+    if not directory:
+        raise click.ClickException('Set TEMPLATE_CACHE_DIR or pass --directory.')
+    names = precompile_templates(directory)
+    click.echo(f'{len(names)} templates compiled into {directory}.')
+
+@app.cli.command('sweep')
+def sweep():
+    """Mark past Booked appointments as Missed and remove past schedules."""
+    missed, removed = sweep_outdated_entities()
+    click.echo(f'{missed} appointments marked Missed, {removed} past schedules removed.')
+
+@app.cli.command('schedules')
+@click.option('--days', type = click.IntRange(1, AVAILABILITY_HORIZON_DAYS), default = SCHEDULE_WINDOW_DAYS, show_default = True,
+              help = f'Number of days from today to cover, at most {AVAILABILITY_HORIZON_DAYS} (the availability form\'s horizon).')
+def schedules(days):
+    """Create the missing schedule days for every active doctor."""
+    created = materialize_schedules(days = days)
+    click.echo(f'{created} schedules created.')
+
+@app.cli.command('search-reindex')
+def search_reindex():
+    """Rebuild the full-text search indexes from the base tables."""
+    create_search_index(rebuild = True)
+    click.echo('Search indexes rebuilt.')
+
+@app.cli.command('rollups-rebuild')
+def rollups_rebuild():
+    """Recompute the daily appointment and department rollups from scratch."""
+    rebuild_rollups()
+    click.echo('Rollups rebuilt.')
+
+@app.cli.command('export')
+@click.argument('entity', type = click.Choice(sorted(EXPORTS)))
+@click.option('--format', 'format', type = click.Choice(sorted(FORMATS)), default = 'csv', show_default = True)
+@click.option('--role', type = click.Choice(['admin', 'doctor', 'patient']), help = 'Restrict to one doctor or patient (with --id).')
+@click.option('--id', 'id', type = int)
+@click.option('--date', help = 'Only rows for this appointment date (YYYY-MM-DD).')
+@click.option('--output', type = click.File('w'), default = '-', help = 'File to write, stdout by default.')
+def export(entity, format, role, id, date, output):
+    """Stream appointments, treatments or patients as CSV or NDJSON."""
+    for chunk in export_chunks(entity, format, role, id, parse_date(date)):
+        output.write(chunk)
+
+@app.cli.command('import')
+@click.argument('role', type = click.Choice(sorted(IMPORT_MODELS)))
+@click.argument('path', type = click.Path(exists = True, dir_okay = False))
+@click.option('--workers', type = int, help = 'Processes used for password hashing, all CPUs by default.')
+def import_users_command(role, path, workers):
+    """Bulk import patients or doctors from a CSV or JSON file."""
+    try:
+        records = read_records(path)
+    except (ValueError, csv.Error) as e:
+        raise click.ClickException(f'Could not read {path}: {e}')
+    created, errors = import_users(role, records, workers)
+    for line, username, message in errors:
+        click.echo(f'Row {line} ({username or "-"}): {message}', err = True)
+    click.echo(f'{created} {role}s imported, {len(errors)} rows rejected.')
+
+@app.cli.command('synthesize')
+@click.option('--departments', default = 20, show_default = True)
+@click.option('--doctors', default = 1000, show_default = True)
+@click.option('--patients', default = 1000000, show_default = True)
+@click.option('--appointments', default = 10000000, show_default = True, help = 'Completed ones also get a treatment.')
+@click.option('--seed', default = 1, show_default = True, help = 'Same seed, same data.')
+def synthesize(departments, doctors, patients, appointments, seed):
+    """Fill the database with reproducible synthetic data for benchmarking."""
+    generate(departments, doctors, patients, appointments, seed, progress = click.echo)
+
+@app.cli.command('benchmark')
+@click.option('--iterations', default = 100, show_default = True, help = 'Requests per scenario.')
+@click.option('--seed', default = 1, show_default = True)
+@click.option('--scenario', 'only', multiple = True, help = 'Run only these scenarios (repeatable).')
+@click.option('--output', default = None, help = 'JSON results file, benchmark-<timestamp>.json by default.')
+@click.option('--baseline', type = click.File('r'), help = 'Earlier results file to compare against.')
+def benchmark(iterations, seed, only, output, baseline):
+    """Measure route latency percentiles and queries per request. Books appointments, so use a synthetic database."""
+    results = run_benchmark(iterations, seed, only, progress = click.echo)
+    if baseline:
+        results['change_percent'] = compare(results, json.load(baseline))
+        for name, change in results['change_percent'].items():
+            click.echo(f'{name}: ' + ', '.join(f'{key} {value:+}%' for key, value in change.items() if value is not None))
+    output = output or f'benchmark-{results["timestamp"].replace(":", "")}.json'
+    save_results(results, output)
+    click.echo(f'Results written to {output}')
+
+@app.cli.command('startup-benchmark')
+@click.option('--runs', default = 5, show_default = True, help = 'Fresh processes to start.')
+@click.option('--set', 'settings', multiple = True, help = 'NAME=VALUE environment override for the started processes (repeatable).')
+@click.option('--output', default = None, help = 'JSON results file, startup-<timestamp>.json by default.')
+def startup_benchmark(runs, settings, output):
+    """Measure import-to-first-response time of freshly started processes."""
+    if any('=' not in setting for setting in settings):
+        raise click.ClickException('--set takes NAME=VALUE.')
+    results = run_startup_benchmark(runs, dict(setting.split('=', 1) for setting in settings), progress = click.echo)
+    for key, value in results['startup'].items():
+        click.echo(f'{key}: median {value["median"]} ms (min {value["min"]}, max {value["max"]})')
+    output = output or f'startup-{results["timestamp"].replace(":", "")}.json'
+    save_results(results, output)
+    click.echo(f'Results written to {output}')
+
+@app.cli.command('replica-sync')
+def replica_sync():
+    """Copy a SQLite primary onto each SQLite replica, for trying replica routing locally."""
+    if not REPLICA_KEYS:
+        raise click.ClickException('No SQLALCHEMY_REPLICA_URIS configured.')
+    if db.engine.dialect.name != 'sqlite' or any(db.engines[key].dialect.name != 'sqlite' for key in REPLICA_KEYS):
+        raise click.ClickException('replica-sync only copies SQLite files; use the database\'s own replication otherwise.')
+    primary = db.engine.raw_connection()
+    try:
+        for key in REPLICA_KEYS:
+            replica = db.engines[key].raw_connection()
+            try:
+                primary.driver_connection.backup(replica.driver_connection)
+            finally:
+                replica.close()
+            click.echo(f'{key} synced from the primary.')
+    finally:
+        primary.close()
@@ -1,9 +1,94 @@
 from dotenv import load_dotenv
-import os 
+from sqlalchemy.engine import make_url
+import os
 # from app import app
 
+#Typed environment readers; unset or empty variables fall back to the default
+TRUE_VALUES = ('1', 'true', 'yes', 'on')
+FALSE_VALUES = ('0', 'false', 'no', 'off')
+
+def env_str(name, default = None):
+    value = os.getenv(name)
+    return value if value not in (None, '') else default
+
+def env_int(name, default):
+    value = env_str(name)
+    try:
+        return int(value) if value is not None else default
+    except ValueError:
+        raise ValueError(f'{name} must be an integer, got {value!r}.')
+
+def env_bool(name, default):
+    value = env_str(name)
+    if value is None:
+        return default
+    if value.lower() in TRUE_VALUES:
+        return True
+    if value.lower() in FALSE_VALUES:
+        return False
+    raise ValueError(f'{name} must be true or false, got {value!r}.')
+
+def env_list(name):
+    return [item.strip() for item in (env_str(name) or '').split(',') if item.strip()]
+
+def is_sqlite_file(uri):
+    url = make_url(uri)
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:') and 'mode=memory' not in uri
+
+def engine_options(uri):
+    # Pool settings only apply to pooled databases; in-memory SQLite keeps SQLAlchemy's single-connection pool
+    if not uri or (make_url(uri).get_backend_name() == 'sqlite' and not is_sqlite_file(uri)):
+        return {}
+    options = {
+        'pool_size': env_int('DB_POOL_SIZE', 5),
+        'max_overflow': env_int('DB_MAX_OVERFLOW', 10),
+        'pool_timeout': env_int('DB_POOL_TIMEOUT', 30),
+        'pool_recycle': env_int('DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': env_bool('DB_POOL_PRE_PING', True),
+    }
+    statement_timeout = env_int('DB_STATEMENT_TIMEOUT_MS', 0)
+    if statement_timeout and make_url(uri).get_backend_name() == 'postgresql':
+        options['connect_args'] = {'options': f'-c statement_timeout={statement_timeout}'}
+    return options
+
 def configure_app(app):
     load_dotenv()
-    app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
-    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('SQLALCHEMY_DATABASE_URI')
-    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = os.getenv('SQLALCHEMY_TRACK_MODIFICATIONS')
\ No newline at end of file
+    app.config['SECRET_KEY'] = env_str('SECRET_KEY')
+    app.config['SQLALCHEMY_DATABASE_URI'] = env_str('SQLALCHEMY_DATABASE_URI')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = env_bool('SQLALCHEMY_TRACK_MODIFICATIONS', False)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+    app.config['SQLALCHEMY_BINDS'] = {f'replica_{i}': uri for i, uri in enumerate(env_list('SQLALCHEMY_REPLICA_URIS'))}
+    app.config['REPLICA_STICKY_SECONDS'] = env_int('REPLICA_STICKY_SECONDS', 5)
+    app.config['SQLITE_PRAGMAS'] = {
+        'journal_mode': env_str('SQLITE_JOURNAL_MODE', 'WAL'),
+        'synchronous': env_str('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        'busy_timeout': env_int('SQLITE_BUSY_TIMEOUT_MS', 5000),
+        'cache_size': env_int('SQLITE_CACHE_SIZE', -64000),
+        'mmap_size': env_int('SQLITE_MMAP_SIZE', 268435456),
+    }
+    app.config['PAGE_SIZE'] = env_int('PAGE_SIZE', 25)
+    app.config['MAX_PAGE_SIZE'] = env_int('MAX_PAGE_SIZE', 100)
+    app.config['REFERENCE_CACHE_TTL'] = env_int('REFERENCE_CACHE_TTL', 300)
+    app.config['FRAGMENT_CACHE_SIZE'] = env_int('FRAGMENT_CACHE_SIZE', 256)
+    app.config['SEARCH_LIMIT'] = env_int('SEARCH_LIMIT', 50)
+    app.config['SLOT_MINUTES'] = env_int('SLOT_MINUTES', 0)
+    app.config['DAY_START'] = env_str('DAY_START', '08:00')
+    app.config['DAY_HOURS'] = env_int('DAY_HOURS', 12)
+    app.config['IDENTITY_TTL'] = env_int('IDENTITY_TTL', 30)
+    app.config['STATS_TTL'] = env_int('STATS_TTL', 60)
+    app.config['PASSWORD_HASH_METHOD'] = env_str('PASSWORD_HASH_METHOD', 'scrypt')
+    app.config['PASSWORD_SALT_LENGTH'] = env_int('PASSWORD_SALT_LENGTH', 16)
+    app.config['PASSWORD_HASH_WORKERS'] = env_int('PASSWORD_HASH_WORKERS', 4)
+    app.config['SERVER_TIMING'] = env_bool('SERVER_TIMING', False)
+    app.config['SLOW_REQUEST_MS'] = env_int('SLOW_REQUEST_MS', 500)
+    app.config['SLOW_REQUEST_QUERIES'] = env_int('SLOW_REQUEST_QUERIES', 30)
+    app.config['METRICS_TOKEN'] = env_str('METRICS_TOKEN')
+    app.config['AUTO_INIT_DB'] = env_bool('AUTO_INIT_DB', False)
+    app.config['STARTUP_WARM'] = env_bool('STARTUP_WARM', True)
+    app.config['TEMPLATE_CACHE_DIR'] = env_str('TEMPLATE_CACHE_DIR')
+    app.config['ASGI_THREADS'] = env_int('ASGI_THREADS', 16)
+    # Request threads waiting on the hash pool are capped so that at least PASSWORD_HASH_WORKERS threads stay free for other requests
+    app.config['PASSWORD_QUEUE_LIMIT'] = min(env_int('PASSWORD_QUEUE_LIMIT', 64),
+                                             max(1, app.config['ASGI_THREADS'] - app.config['PASSWORD_HASH_WORKERS']))
+    app.config['ASGI_WORKERS'] = env_int('ASGI_WORKERS', 1)
+    app.config['ASGI_GRACEFUL_TIMEOUT'] = env_int('ASGI_GRACEFUL_TIMEOUT', 30)
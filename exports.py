@@ -0,0 +1,80 @@
+from models import db, Department, Doctor, Patient, Appointment, Treatment
+from sqlalchemy import select
+from datetime import datetime
+import csv, io, json
+
+#Streaming exports: plain column rows are read through a server-side cursor and written out in chunks
+CHUNK_ROWS = 1000
+
+def appointments_query(role = None, id = None, date = None):
+    query = select(Appointment.id, Appointment.date, Appointment.slot, Appointment.status, Appointment.visit_type,
+                   Appointment.doctor_id, Doctor.name.label('doctor_name'), Department.name.label('department'),
+                   Appointment.patient_id, Patient.name.label('patient_name')
+    ).join(Doctor, Doctor.id == Appointment.doctor_id).outerjoin(Department, Department.id == Doctor.department_id
+    ).join(Patient, Patient.id == Appointment.patient_id)
+    if role == 'doctor':
+        query = query.where(Appointment.doctor_id == id)
+    elif role == 'patient':
+        query = query.where(Appointment.patient_id == id)
+    if date:
+        query = query.where(Appointment.date == date)
+    return query.order_by(Appointment.id.asc())
+
+def treatments_query(role = None, id = None, date = None):
+    query = select(Treatment.id, Treatment.appointment_id, Appointment.date, Treatment.patient_id, Patient.name.label('patient_name'),
+                   Treatment.doctor_id, Doctor.name.label('doctor_name'), Treatment.diagnosis, Treatment.treatment, Treatment.instruction
+    ).join(Appointment, Appointment.id == Treatment.appointment_id).join(Patient, Patient.id == Treatment.patient_id
+    ).join(Doctor, Doctor.id == Treatment.doctor_id)
+    if role == 'doctor':
+        query = query.where(Treatment.doctor_id == id)
+    elif role == 'patient':
+        query = query.where(Treatment.patient_id == id)
+    if date:
+        query = query.where(Appointment.date == date)
+    return query.order_by(Treatment.id.asc())
+
+def patients_query(role = None, id = None, date = None):
+    query = select(Patient.id, Patient.username, Patient.name, Patient.address, Patient.contact, Patient.status)
+    if role == 'patient':
+        query = query.where(Patient.id == id)
+    return query.order_by(Patient.id.asc())
+
+EXPORTS = {'appointments': appointments_query, 'treatments': treatments_query, 'patients': patients_query}
+FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+def export_scope(entity, user_role, user_id, role = None, id = None):
+    # Admins may export anything; doctors and patients only their own records. None means access denied
+    if user_role == 'admin':
+        return role, id
+    if entity == 'patients' and user_role != 'patient':
+        return None
+    return user_role, user_id
+
+def parse_date(value):
+    return datetime.strptime(value, "%Y-%m-%d").date() if value else None
+
+def stream_rows(query):
+    result = db.session.execute(query.execution_options(stream_results = True, yield_per = CHUNK_ROWS))
+    return result.keys(), result.partitions()
+
+def header_chunk(columns, format):
+    if format != 'csv':
+        return ''
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(columns)
+    return buffer.getvalue()
+
+def rows_chunk(columns, rows, format):
+    if format == 'csv':
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue()
+    return ''.join(json.dumps(dict(zip(columns, row)), default = str) + '\n' for row in rows)
+
+def export_chunks(entity, format, role = None, id = None, date = None):
+    # Yields text chunks of about CHUNK_ROWS rows each, so memory stays flat however large the export
+    columns, partitions = stream_rows(EXPORTS[entity](role, id, date))
+    columns = list(columns)
+    yield header_chunk(columns, format)
+    for rows in partitions:
+        yield rows_chunk(columns, rows, format)
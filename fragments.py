@@ -0,0 +1,87 @@
+from app import app
+from models import db, Data_Version
+from rollups import upsert_add_many
+from flask import request, session, render_template, make_response, before_render_template, template_rendered
+from collections import OrderedDict
+from threading import Lock
+import hashlib
+
+#Rendered page blocks cached per (template, page, role, data versions); the same versions make the page's ETag
+CACHED_BLOCKS = ('title', 'style', 'content')
+
+class FragmentCache:
+    # Entries never go stale, a write bumps the version instead, so old keys simply age out of the LRU
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.lock = Lock()
+
+    def get(self, key, render):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+        value = render()
+        with self.lock:
+            self.entries[key] = value
+            while len(self.entries) > self.size:
+                self.entries.popitem(last = False)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'not_modified': self.not_modified,
+                    'entries': len(self.entries), 'size': self.size}
+
+fragment_cache = FragmentCache(app.config['FRAGMENT_CACHE_SIZE'])
+
+def data_versions(*groups):
+    # Versions live in the database so every worker process agrees on them, and on the ETags built from them
+    versions = dict(db.session.query(Data_Version.name, Data_Version.version).filter(Data_Version.name.in_(groups)))
+    return tuple(versions.get(group, 0) for group in groups)
+
+def bump_versions(*groups):
+    upsert_add_many(Data_Version, ['name'], 'version', [{'name': group, 'version': 1} for group in groups])
+    db.session.commit()
+
+def render_blocks(template_name, context):
+    # Renders only the page's own blocks; the layout around them (navbar, flashes) stays per request
+    template = app.jinja_env.get_template(template_name)
+    app.update_template_context(context)
+    before_render_template.send(app, _async_wrapper = app.ensure_sync, template = template, context = context)
+    blocks = {name: ''.join(template.blocks[name](template.new_context(context))) for name in CACHED_BLOCKS if name in template.blocks}
+    template_rendered.send(app, _async_wrapper = app.ensure_sync, template = template, context = context)
+    return blocks
+
+def render_cached(template_name, groups, load, key = None):
+    # load() returns the template context and only runs on a cache miss; it must read the database, not another
+    # per-process cache, or a page written by a worker that missed an invalidation would be stored under the new versions.
+    # key names what the page depends on besides its template (the full URL by default). The navbar links to the
+    # signed-in user, so the ETag covers the user while the cached blocks are shared by role
+    key = request.full_path if key is None else key
+    role = session.get('role')
+    versions = data_versions(*groups)
+    etag = hashlib.blake2b(repr((template_name, key, role, session.get('user_id'), versions)).encode(),
+                           digest_size = 16).hexdigest()
+    # A pending flash message must reach the page, so such responses are neither 304s nor revalidated later
+    conditional = '_flashes' not in session
+    if conditional and request.if_none_match.contains_weak(etag):
+        with fragment_cache.lock:
+            fragment_cache.not_modified += 1
+        response = make_response('', 304)
+    else:
+        blocks = fragment_cache.get((template_name, key, role, versions), lambda: render_blocks(template_name, load()))
+        response = make_response(render_template('fragment.html', blocks = blocks))
+    if conditional:
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
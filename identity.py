@@ -0,0 +1,35 @@
+from flask import g, session
+from sqlalchemy.orm import Session, joinedload
+from app import app
+from cache import TTLCache
+from models import db, Doctor, USER_MODELS
+
+#Per-request identity, memoized per user for IDENTITY_TTL seconds
+identity_cache = TTLCache(app.config['IDENTITY_TTL'])
+
+def load_user(role, id):
+    # Loaded in a private session so the detached row can be shared between requests
+    model = USER_MODELS[role]
+    with Session(db.engine) as private:
+        query = private.query(model)
+        if model is Doctor:
+            query = query.options(joinedload(Doctor.department))
+        return query.filter(model.id == id).first()
+
+def cached_user(role, id):
+    if role not in USER_MODELS:
+        return None
+    id = int(id)
+    return identity_cache.get(('identity', role, id), lambda: load_user(role, id))
+
+def current_identity():
+    # Resolved at most once per request; None when logged out or the account no longer exists
+    if 'identity' not in g:
+        g.identity = cached_user(session['role'], session['user_id']) if 'user_id' in session else None
+    return g.identity
+
+def invalidate_identity(role = None, id = None):
+    if role is None:
+        identity_cache.invalidate('identity')
+    else:
+        identity_cache.discard(('identity', role, int(id)))
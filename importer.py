@@ -0,0 +1,126 @@
+from models import db, Department, Doctor, Patient
+from services import materialize_schedules
+from fragments import bump_versions
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from passwords import hash_password
+from concurrent.futures import ProcessPoolExecutor
+import csv, json, os
+
+#Bulk import of patients and doctors from CSV or JSON files
+BATCH_ROWS = 500
+IMPORT_MODELS = {'patient': Patient, 'doctor': Doctor}
+IMPORT_FIELDS = {
+    'patient': ['username', 'password', 'name', 'address', 'contact'],
+    'doctor': ['username', 'password', 'name', 'address', 'contact', 'description'],
+}
+
+def read_records(path):
+    # CSV needs a header row; JSON is a list of objects with the same keys
+    if path.lower().endswith('.json'):
+        with open(path) as file:
+            records = json.load(file)
+        if not isinstance(records, list):
+            raise ValueError('JSON imports must be a list of objects.')
+        return records
+    with open(path, newline = '') as file:
+        return list(csv.DictReader(file))
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def existing_usernames(model, usernames):
+    found = set()
+    for batch in chunked(list(usernames), BATCH_ROWS):
+        found.update(username for username, in db.session.query(model.username).filter(model.username.in_(batch)))
+    return found
+
+def department_lookup():
+    # Doctors may name their department by id or by name
+    lookup = {}
+    for id, name in db.session.query(Department.id, Department.name):
+        lookup[str(id)] = id
+        lookup[name.strip().lower()] = id
+    return lookup
+
+def validate(role, records):
+    model = IMPORT_MODELS[role]
+    rows, errors, seen = [], [], set()
+    departments = department_lookup() if role == 'doctor' else {}
+
+    for line, record in enumerate(records, start = 1):
+        if not isinstance(record, dict):
+            errors.append((line, None, 'Not a record'))
+            continue
+        row = {field: str(record.get(field) or '').strip() for field in IMPORT_FIELDS[role]}
+        missing = [field for field in IMPORT_FIELDS[role] if not row[field]]
+        if missing:
+            errors.append((line, row['username'] or None, f'Missing {", ".join(missing)}'))
+            continue
+        too_long = [field for field in IMPORT_FIELDS[role] if field != 'password' and len(row[field]) > model.__table__.c[field].type.length]
+        if too_long:
+            errors.append((line, row['username'], f'Too long: {", ".join(too_long)}'))
+            continue
+        if row['username'] in seen:
+            errors.append((line, row['username'], 'Duplicate username in file'))
+            continue
+        if role == 'doctor':
+            department = str(record.get('department_id') or record.get('department') or '').strip()
+            if department and department.lower() not in departments:
+                errors.append((line, row['username'], f'Unknown department {department}'))
+                continue
+            row['department_id'] = departments.get(department.lower())
+        seen.add(row['username'])
+        rows.append((line, row))
+
+    # One round of IN queries against the unique username column instead of one lookup per row
+    taken = existing_usernames(model, seen)
+    errors.extend((line, row['username'], 'Username already exists') for line, row in rows if row['username'] in taken)
+    rows = [(line, row) for line, row in rows if row['username'] not in taken]
+    return rows, errors
+
+def hash_passwords(passwords, workers = None):
+    # Password hashing is CPU bound, so it is spread over processes rather than threads
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(passwords) < 2:
+        return [hash_password(password) for password in passwords]
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        return list(pool.map(hash_password, passwords, chunksize = max(1, len(passwords) // (workers * 4))))
+
+def insert_batch(model, batch, errors):
+    try:
+        db.session.execute(insert(model), [row for line, row in batch])
+        db.session.commit()
+        return [row['username'] for line, row in batch]
+    except IntegrityError:
+        # Something changed since validation; retry row by row so only the offending rows are reported
+        db.session.rollback()
+    inserted = []
+    for line, row in batch:
+        try:
+            db.session.execute(insert(model), [row])
+            db.session.commit()
+            inserted.append(row['username'])
+        except IntegrityError as e:
+            db.session.rollback()
+            errors.append((line, row['username'], str(e.orig)))
+    return inserted
+
+def import_users(role, records, workers = None):
+    model = IMPORT_MODELS[role]
+    rows, errors = validate(role, records)
+    hashes = hash_passwords([row.pop('password') for line, row in rows], workers)
+    for (line, row), passhash in zip(rows, hashes):
+        row['passhash'] = passhash
+
+    inserted = []
+    for batch in chunked(rows, BATCH_ROWS):
+        inserted.extend(insert_batch(model, batch, errors))
+
+    if role == 'doctor' and inserted:
+        doctor_ids = [id for batch in chunked(inserted, BATCH_ROWS)
+                      for id, in db.session.query(Doctor.id).filter(Doctor.username.in_(batch))]
+        materialize_schedules(doctor_ids)
+        bump_versions('doctors')
+    return len(inserted), sorted(errors, key = lambda error: error[0])
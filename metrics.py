@@ -0,0 +1,172 @@
+from app import app
+from flask import g, request, has_app_context, before_render_template, template_rendered, Response
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+from passwords import hash_pool
+from threading import Lock
+from contextvars import ContextVar
+import time
+
+#Per-request instrumentation: SQL statements and time, template render time and latency, exported at /metrics
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Counters of a request served by an async handler in asgi.py, which has no Flask request context
+async_request_metrics = ContextVar('async_request_metrics', default = None)
+
+class RequestMetrics:
+    def __init__(self):
+        self.lock = Lock()
+        self.requests = {}
+        self.endpoints = {}
+
+    def observe(self, endpoint, method, status, latency, queries, db_time, render_time):
+        with self.lock:
+            key = (endpoint, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            totals = self.endpoints.setdefault(endpoint, {'count': 0, 'latency': 0.0, 'queries': 0, 'db': 0.0,
+                                                           'render': 0.0, 'buckets': [0] * len(LATENCY_BUCKETS)})
+            totals['count'] += 1
+            totals['latency'] += latency
+            totals['queries'] += queries
+            totals['db'] += db_time
+            totals['render'] += render_time
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if latency <= bound:
+                    totals['buckets'][i] += 1
+
+    def render(self):
+        # Prometheus text exposition format
+        with self.lock:
+            lines = ['# HELP hms_requests_total Requests handled, by endpoint, method and status.',
+                     '# TYPE hms_requests_total counter']
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append(f'hms_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {count}')
+
+            lines += ['# HELP hms_request_duration_seconds Request latency.', '# TYPE hms_request_duration_seconds histogram']
+            for endpoint, totals in sorted(self.endpoints.items()):
+                for bound, count in zip(LATENCY_BUCKETS, totals['buckets']):
+                    lines.append(f'hms_request_duration_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {count}')
+                lines.append(f'hms_request_duration_seconds_bucket{{endpoint="{endpoint}",le="+Inf"}} {totals["count"]}')
+                lines.append(f'hms_request_duration_seconds_sum{{endpoint="{endpoint}"}} {totals["latency"]:.6f}')
+                lines.append(f'hms_request_duration_seconds_count{{endpoint="{endpoint}"}} {totals["count"]}')
+
+            for name, field, help in (('hms_request_queries_total', 'queries', 'SQL statements executed while handling requests.'),
+                                      ('hms_request_db_seconds_total', 'db', 'Time spent executing SQL statements.'),
+                                      ('hms_request_render_seconds_total', 'render', 'Time spent rendering templates.')):
+                lines += [f'# HELP {name} {help}', f'# TYPE {name} counter']
+                for endpoint, totals in sorted(self.endpoints.items()):
+                    value = totals[field]
+                    lines.append(f'{name}{{endpoint="{endpoint}"}} {value if field == "queries" else f"{value:.6f}"}')
+        return '\n'.join(lines) + '\n'
+
+request_metrics = RequestMetrics()
+
+class TimedQueuePool(QueuePool):
+    # Records how long each checkout waited for a pooled connection, including the time to open a new one
+    waits = {'count': 0, 'total': 0.0, 'max': 0.0, 'buckets': [0] * len(LATENCY_BUCKETS)}
+    lock = Lock()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - start
+            with self.lock:
+                self.waits['count'] += 1
+                self.waits['total'] += waited
+                self.waits['max'] = max(self.waits['max'], waited)
+                for i, bound in enumerate(LATENCY_BUCKETS):
+                    if waited <= bound:
+                        self.waits['buckets'][i] += 1
+
+    def render_metrics(self):
+        with self.lock:
+            waits = dict(self.waits, buckets = list(self.waits['buckets']))
+        lines = ['# HELP hms_db_pool_checkout_wait_seconds Time spent waiting for a database connection.',
+                 '# TYPE hms_db_pool_checkout_wait_seconds histogram']
+        for bound, count in zip(LATENCY_BUCKETS, waits['buckets']):
+            lines.append(f'hms_db_pool_checkout_wait_seconds_bucket{{le="{bound}"}} {count}')
+        lines += [f'hms_db_pool_checkout_wait_seconds_bucket{{le="+Inf"}} {waits["count"]}',
+                  f'hms_db_pool_checkout_wait_seconds_sum {waits["total"]:.6f}',
+                  f'hms_db_pool_checkout_wait_seconds_count {waits["count"]}',
+                  '# HELP hms_db_pool_checkout_wait_max_seconds Longest connection checkout wait since start.',
+                  '# TYPE hms_db_pool_checkout_wait_max_seconds gauge',
+                  f'hms_db_pool_checkout_wait_max_seconds {waits["max"]:.6f}',
+                  '# HELP hms_db_pool_checked_out Connections currently checked out of the pool.',
+                  '# TYPE hms_db_pool_checked_out gauge',
+                  f'hms_db_pool_checked_out {self.checkedout()}',
+                  '# HELP hms_db_pool_overflow Connections open beyond the pool size.',
+                  '# TYPE hms_db_pool_overflow gauge',
+                  f'hms_db_pool_overflow {max(self.overflow(), 0)}']
+        return '\n'.join(lines) + '\n'
+
+def current_metrics():
+    # Statements run outside a request (CLI commands, startup) are not attributed to anything
+    metrics = async_request_metrics.get()
+    if metrics is not None:
+        return metrics
+    return g.get('metrics') if has_app_context() else None
+
+def instrument_engine(engine):
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_start'].pop()
+        metrics = current_metrics()
+        if metrics is not None:
+            metrics['queries'] += 1
+            metrics['db'] += elapsed
+
+def before_render(sender, template, context, **extra):
+    metrics = current_metrics()
+    if metrics is not None:
+        metrics['render_start'] = time.perf_counter()
+
+def after_render(sender, template, context, **extra):
+    metrics = current_metrics()
+    if metrics is not None and 'render_start' in metrics:
+        metrics['render'] += time.perf_counter() - metrics.pop('render_start')
+
+before_render_template.connect(before_render, app)
+template_rendered.connect(after_render, app)
+
+@app.before_request
+def start_request_metrics():
+    g.metrics = {'start': time.perf_counter(), 'queries': 0, 'db': 0.0, 'render': 0.0}
+
+@app.after_request
+def finish_request_metrics(response):
+    metrics = g.pop('metrics', None)
+    if metrics is None:
+        return response
+    latency = time.perf_counter() - metrics['start']
+    endpoint = request.endpoint or 'unmatched'
+    request_metrics.observe(endpoint, request.method, response.status_code, latency, metrics['queries'], metrics['db'], metrics['render'])
+
+    if app.config['SERVER_TIMING']:
+        response.headers['Server-Timing'] = (f'db;dur={metrics["db"] * 1000:.1f};desc="{metrics["queries"]} queries", '
+                                             f'render;dur={metrics["render"] * 1000:.1f}, total;dur={latency * 1000:.1f}')
+    if latency * 1000 > app.config['SLOW_REQUEST_MS'] or metrics['queries'] > app.config['SLOW_REQUEST_QUERIES']:
+        app.logger.warning('Slow request %s %s (%s): %.1f ms, %d queries, %.1f ms SQL, %.1f ms render', request.method,
+                           request.path, endpoint, latency * 1000, metrics['queries'], metrics['db'] * 1000, metrics['render'] * 1000)
+    return response
+
+@app.route('/metrics')
+def metrics():
+    token = app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return Response('Unauthorized\n', status = 401, mimetype = 'text/plain')
+    hashing = hash_pool.stats()
+    gauges = ('# HELP hms_password_queue_depth Password hashing jobs queued or running.\n'
+              '# TYPE hms_password_queue_depth gauge\n'
+              f'hms_password_queue_depth {hashing["queue_depth"]}\n'
+              '# HELP hms_password_rejected_total Password hashing jobs refused because the queue was full.\n'
+              '# TYPE hms_password_rejected_total counter\n'
+              f'hms_password_rejected_total {hashing["rejected"]}\n')
+    pool = app.extensions['sqlalchemy'].engine.pool
+    if isinstance(pool, TimedQueuePool):
+        gauges += pool.render_metrics()
+    return Response(request_metrics.render() + gauges, mimetype = 'text/plain; version=0.0.4')
@@ -1,8 +1,49 @@
 from app import app
+from flask import g, request, session, has_request_context
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask_sqlalchemy.session import Session
+from passwords import hash_password
+from sqlalchemy import inspect, text, event, Select, MetaData, BigInteger, select, update, delete, func, and_
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.sql.dml import UpdateBase
+from slots import has_slot
+from itertools import count
+import time
+from metrics import instrument_engine, TimedQueuePool
+from config import is_sqlite_file
 
-db = SQLAlchemy(app)
+#Read replicas: SQLALCHEMY_REPLICA_URIS become the replica_<n> binds
+REPLICA_KEYS = sorted(key for key in app.config['SQLALCHEMY_BINDS'] if key.startswith('replica_'))
+replica_turn = count()
+# Only these endpoints read from replicas; any handler whose reads decide what it writes next stays on the primary
+REPLICA_ENDPOINTS = frozenset({'dashboard', 'admin_dashboard', 'doctor_dashboard', 'patient_dashboard', 'doctors', 'patients', 'departments',
+                               'view_department', 'earliest_slots', 'search', 'appointments', 'treatment_history', 'view_treatment',
+                               'export'})
+
+def note_write():
+    # Read-your-writes: the rest of this request and the browser's next REPLICA_STICKY_SECONDS stay on the primary
+    if has_request_context():
+        g.wrote = True
+        session['last_write'] = time.time()
+
+def reads_from_replica():
+    if not has_request_context() or request.method not in ('GET', 'HEAD') or request.endpoint not in REPLICA_ENDPOINTS or g.get('wrote'):
+        return False
+    return time.time() - session.get('last_write', 0) > app.config['REPLICA_STICKY_SECONDS']
+
+class RoutingSession(Session):
+    # Plain SELECTs made while serving a GET to a REPLICA_ENDPOINTS route go to the replicas in turn; everything else uses the primary
+    def get_bind(self, mapper = None, clause = None, bind = None, **kwargs):
+        if bind is None and REPLICA_KEYS:
+            if self._flushing or isinstance(clause, UpdateBase):
+                note_write()
+            elif isinstance(clause, Select) and reads_from_replica():
+                return self._db.engines[REPLICA_KEYS[next(replica_turn) % len(REPLICA_KEYS)]]
+        return super().get_bind(mapper = mapper, clause = clause, bind = bind, **kwargs)
+
+# Pooled databases get a QueuePool that reports checkout waits at /metrics
+db = SQLAlchemy(app, session_options = {'class_': RoutingSession},
+                engine_options = {'poolclass': TimedQueuePool} if 'pool_size' in app.config['SQLALCHEMY_ENGINE_OPTIONS'] else {})
 
 class Admin(db.Model):
     __tablename__ = 'Admins'
@@ -38,6 +79,8 @@ class Doctor(db.Model):
     description = db.Column(db.String(256), nullable = False)
     status = db.Column(db.String(20), nullable = False, default = 'Active')
 
+    __table_args__ = (db.Index('ix_doctors_department_status', 'department_id', 'status'),)
+
     appointments = db.relationship('Appointment', backref = 'doctor', lazy = True)
     schedule = db.relationship('Doctor_Schedule', backref = 'doctor', cascade='all, delete-orphan', lazy = True)
 
@@ -65,7 +108,12 @@ class Appointment(db.Model):
     slot = db.Column(db.Integer, nullable = False)
     status = db.Column(db.String(20), nullable = False, default = 'Booked')
 
-    __table_args__ = (db.UniqueConstraint('doctor_id', 'slot', 'date', name='unique_doctor_appointment'),)
+    # Cancelled appointments give their slot back, so only the others are unique per doctor, slot and date
+    __table_args__ = (db.Index('unique_doctor_appointment', 'doctor_id', 'slot', 'date', unique = True,
+                               sqlite_where = text("status != 'Cancelled'"), postgresql_where = text("status != 'Cancelled'")),
+                      db.Index('ix_appointments_patient_status', 'patient_id', 'status'),
+                      db.Index('ix_appointments_doctor_status', 'doctor_id', 'status'),
+                      db.Index('ix_appointments_date', 'date'))
 
 class Doctor_Schedule(db.Model):
     __tablename__ = 'Doctor_Schedule'
@@ -73,10 +121,23 @@ class Doctor_Schedule(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     doctor_id = db.Column(db.Integer, db.ForeignKey('Doctors.id'), nullable=False)
     date = db.Column(db.Date, nullable = False)
-    slot_1 = db.Column(db.Boolean, nullable=True)
-    slot_2 = db.Column(db.Boolean, nullable=True)
+    # 64-bit so every slot up to slots.MAX_SLOTS fits; a 32-bit int4 on PostgreSQL would overflow from slot 32
+    open_slots = db.Column(db.BigInteger, nullable = False, default = 0)
+    booked_slots = db.Column(db.BigInteger, nullable = False, default = 0)
     status = db.Column(db.Boolean, nullable= False, default = True)
 
+    # One row per doctor-day: (doctor_id, date) is the natural key that materialize_schedules() conflicts on
+    __table_args__ = (db.Index('ix_doctor_schedule_doctor_date', 'doctor_id', 'date', unique = True),)
+
+    def is_open(self, slot_number):
+        return has_slot(self.open_slots, slot_number)
+
+    def is_booked(self, slot_number):
+        return has_slot(self.booked_slots, slot_number)
+
+    def is_free(self, slot_number):
+        return self.is_open(slot_number) and not self.is_booked(slot_number)
+
 class Treatment(db.Model):
     __tablename__ = 'Treatments'
 
@@ -88,18 +149,140 @@ class Treatment(db.Model):
     treatment = db.Column(db.String(128), nullable = False)
     instruction = db.Column(db.String(128), nullable = False)
 
-    appointment = db.relationship('Appointment', backref = 'treatment', uselist = False,  lazy = True)
+    __table_args__ = (db.Index('ix_treatments_patient', 'patient_id'),
+                      db.Index('ix_treatments_appointment', 'appointment_id'))
+
+    appointment = db.relationship('Appointment', backref = db.backref('treatment', uselist = False), lazy = True)
     patient = db.relationship('Patient', backref = 'treatment', lazy = True)
     doctor = db.relationship('Doctor', backref = 'treatment', lazy = True)
 
-with app.app_context():
+class Appointment_Rollup(db.Model):
+    __tablename__ = 'Appointment_Rollups'
+
+    date = db.Column(db.Date, primary_key = True)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('Doctors.id'), primary_key = True)
+    status = db.Column(db.String(20), primary_key = True)
+    total = db.Column(db.Integer, nullable = False, default = 0)
+
+class Department_Rollup(db.Model):
+    __tablename__ = 'Department_Rollups'
+
+    date = db.Column(db.Date, primary_key = True)
+    department_id = db.Column(db.Integer, db.ForeignKey('Departments.id'), primary_key = True)
+    bookings = db.Column(db.Integer, nullable = False, default = 0)
+
+class Data_Version(db.Model):
+    __tablename__ = 'Data_Versions'
+
+    name = db.Column(db.String(40), primary_key = True)
+    version = db.Column(db.Integer, nullable = False, default = 0)
+
+USER_MODELS = {'admin': Admin, 'doctor': Doctor, 'patient': Patient}
+
+def create_missing_indexes():
+    # create_all() skips tables that already exist, so indexes added later are created here
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst = True)
+
+def migrate_appointment_uniqueness():
+    # Databases created with the table-level UNIQUE (doctor_id, slot, date) get the partial unique index instead
+    constraints = inspect(db.engine).get_unique_constraints('Appointments')
+    if not any(constraint['name'] == 'unique_doctor_appointment' for constraint in constraints):
+        return
+    with db.engine.begin() as conn:
+        if db.engine.dialect.name == 'sqlite':
+            # SQLite cannot drop a constraint: copy into a table without it and swap the names
+            scratch = MetaData()
+            for table in (Patient.__table__, Doctor.__table__):
+                table.to_metadata(scratch)
+            new_table = Appointment.__table__.to_metadata(scratch, name = 'Appointments_new')
+            conn.execute(CreateTable(new_table))
+            columns = ', '.join(column.name for column in Appointment.__table__.columns)
+            conn.execute(text(f'INSERT INTO "Appointments_new" ({columns}) SELECT {columns} FROM "Appointments"'))
+            conn.execute(text('DROP TABLE "Appointments"'))
+            conn.execute(text('ALTER TABLE "Appointments_new" RENAME TO "Appointments"'))
+        else:
+            conn.execute(text('ALTER TABLE "Appointments" DROP CONSTRAINT unique_doctor_appointment'))
+
+def migrate_slot_bitmaps():
+    # Schedules created with the slot_1/slot_2 columns get their bitmaps filled in once
+    columns = {column['name']: column['type'] for column in inspect(db.engine).get_columns('Doctor_Schedule')}
+    if 'open_slots' in columns:
+        # PostgreSQL bitmaps first created as int4 are widened; SQLite integers are already 64-bit
+        if db.engine.dialect.name == 'postgresql' and not isinstance(columns['open_slots'], BigInteger):
+            with db.engine.begin() as conn:
+                conn.execute(text('ALTER TABLE "Doctor_Schedule" ALTER COLUMN open_slots TYPE BIGINT'))
+                conn.execute(text('ALTER TABLE "Doctor_Schedule" ALTER COLUMN booked_slots TYPE BIGINT'))
+        return
+    with db.engine.begin() as conn:
+        conn.execute(text('ALTER TABLE "Doctor_Schedule" ADD COLUMN open_slots BIGINT NOT NULL DEFAULT 0'))
+        conn.execute(text('ALTER TABLE "Doctor_Schedule" ADD COLUMN booked_slots BIGINT NOT NULL DEFAULT 0'))
+        conn.execute(text('UPDATE "Doctor_Schedule" SET booked_slots = ('
+                          'SELECT COALESCE(SUM(1 << (a.slot - 1)), 0) FROM "Appointments" a '
+                          'WHERE a.doctor_id = "Doctor_Schedule".doctor_id AND a.date = "Doctor_Schedule".date AND a.status = \'Booked\')'))
+        conn.execute(text('UPDATE "Doctor_Schedule" SET open_slots = booked_slots '
+                          '| (CASE WHEN slot_1 THEN 1 ELSE 0 END) | (CASE WHEN slot_2 THEN 2 ELSE 0 END)'))
+
+def migrate_schedule_uniqueness():
+    # Databases from before (doctor_id, date) was unique have each duplicated doctor-day merged into its oldest row
+    # (bitmaps OR-ed together) and the plain index dropped, so create_missing_indexes() can build the unique one
+    indexes = {index['name']: index for index in inspect(db.engine).get_indexes('Doctor_Schedule')}
+    index = indexes.get('ix_doctor_schedule_doctor_date')
+    if index is not None and index['unique']:
+        return
+    schedule = Doctor_Schedule.__table__
+    duplicated = select(schedule.c.doctor_id, schedule.c.date).group_by(schedule.c.doctor_id, schedule.c.date).having(func.count() > 1).subquery()
+    with db.engine.begin() as conn:
+        rows = conn.execute(select(schedule.c.id, schedule.c.doctor_id, schedule.c.date, schedule.c.open_slots, schedule.c.booked_slots).join(
+            duplicated, and_(duplicated.c.doctor_id == schedule.c.doctor_id, duplicated.c.date == schedule.c.date)).order_by(schedule.c.id))
+        kept, removed = {}, []
+        for row in rows:
+            key = (row.doctor_id, row.date)
+            if key in kept:
+                kept[key]['open_slots'] |= row.open_slots
+                kept[key]['booked_slots'] |= row.booked_slots
+                removed.append(row.id)
+            else:
+                kept[key] = {'id': row.id, 'open_slots': row.open_slots, 'booked_slots': row.booked_slots}
+        for values in kept.values():
+            conn.execute(update(schedule).where(schedule.c.id == values['id']).values(open_slots = values['open_slots'], booked_slots = values['booked_slots']))
+        if removed:
+            conn.execute(delete(schedule).where(schedule.c.id.in_(removed)))
+        if index is not None:
+            conn.execute(text('DROP INDEX "ix_doctor_schedule_doctor_date"'))
+
+def apply_sqlite_pragmas(engine):
+    # WAL lets readers carry on while a booking holds the write lock; the rest trade durability on power loss for fewer fsyncs
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in app.config['SQLITE_PRAGMAS'].items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
+
+def create_schema():
     # db.drop_all()
     db.create_all()
+    migrate_appointment_uniqueness()
+    migrate_slot_bitmaps()
+    migrate_schedule_uniqueness()
+    create_missing_indexes()
 
+def seed_admin():
     # Create a new admin programmatically if none exists
     admin = Admin.query.first()
     if not admin:
-        password_hash = generate_password_hash ('admin')
+        password_hash = hash_password('admin')
         admin = Admin(username = 'admin', passhash = password_hash, name = 'admin', address = 'admin address', contact = '0000000000')
         db.session.add(admin)
-        db.session.commit()
\ No newline at end of file
+        db.session.commit()
+        return True
+    return False
+
+# Schema creation and the admin seed run from startup.py; only per-process engine hooks are set up here
+with app.app_context():
+    for key, engine in db.engines.items():
+        instrument_engine(engine)
+        if is_sqlite_file(str(engine.url)):
+            apply_sqlite_pragmas(engine)
\ No newline at end of file
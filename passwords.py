@@ -0,0 +1,61 @@
+from app import app
+from werkzeug.security import generate_password_hash, check_password_hash
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, cache
+import threading
+
+#Password hashing: the method and cost come from config, verification runs on a bounded worker pool
+hash_password = partial(generate_password_hash, method = app.config['PASSWORD_HASH_METHOD'], salt_length = app.config['PASSWORD_SALT_LENGTH'])
+
+class HashingBusy(Exception):
+    pass
+
+class HashPool:
+    # hashlib's scrypt and pbkdf2 release the GIL, so a few threads verify in parallel while request
+    # threads wait; past the queue limit logins are turned away instead of piling up behind each other
+    def __init__(self, workers, limit):
+        self.executor = ThreadPoolExecutor(max_workers = workers, thread_name_prefix = 'passwords')
+        self.workers = workers
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.peak = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def run(self, fn, *args):
+        with self.lock:
+            if self.pending >= self.limit:
+                self.rejected += 1
+                raise HashingBusy()
+            self.pending += 1
+            self.peak = max(self.peak, self.pending)
+        try:
+            return self.executor.submit(fn, *args).result()
+        finally:
+            with self.lock:
+                self.pending -= 1
+                self.completed += 1
+
+    def stats(self):
+        with self.lock:
+            return {'workers': self.workers, 'queue_limit': self.limit, 'queue_depth': self.pending,
+                    'peak_queue_depth': self.peak, 'completed': self.completed, 'rejected': self.rejected}
+
+hash_pool = HashPool(app.config['PASSWORD_HASH_WORKERS'], app.config['PASSWORD_QUEUE_LIMIT'])
+
+@cache
+def current_method():
+    # The method prefix werkzeug stores for the configured parameters, e.g. 'scrypt:32768:8:1'
+    return hash_password('').split('$', 1)[0]
+
+def needs_rehash(passhash):
+    # Stored as method$salt$hash: the method string carries the cost, the salt's length is PASSWORD_SALT_LENGTH
+    parts = passhash.split('$', 2)
+    return len(parts) != 3 or parts[0] != current_method() or len(parts[1]) != app.config['PASSWORD_SALT_LENGTH']
+
+def verify_password(passhash, password):
+    return hash_pool.run(check_password_hash, passhash, password)
+
+def hash_password_async(password):
+    return hash_pool.run(hash_password, password)
@@ -0,0 +1,99 @@
+from models import db, Doctor, Appointment, Appointment_Rollup, Department_Rollup
+from sqlalchemy import func, select, insert
+from sqlalchemy.dialects import sqlite, postgresql
+
+#Daily rollups kept current by the write paths: (date, doctor_id, status) -> total and (date, department_id) -> bookings
+UPSERTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+def upsert_add_many(model, keys, column, rows):
+    # rows hold the key columns and a delta for column; on dialects with an upsert they go out as one executemany
+    rows = [row for row in rows if row[column]]
+    if not rows:
+        return
+    dialect = db.session.get_bind().dialect.name
+    if dialect in UPSERTS:
+        stmt = UPSERTS[dialect](model)
+        stmt = stmt.on_conflict_do_update(index_elements = keys, set_ = {column: getattr(model, column) + getattr(stmt.excluded, column)})
+        db.session.execute(stmt, rows)
+        return
+    for row in rows:
+        updated = db.session.query(model).filter_by(**{key: row[key] for key in keys}).update(
+            {column: getattr(model, column) + row[column]}, synchronize_session = False)
+        if not updated:
+            db.session.execute(insert(model).values(**row))
+
+def upsert_add(model, keys, column, delta):
+    upsert_add_many(model, list(keys), column, [{**keys, column: delta}])
+
+def bump_status(date, doctor_id, status, delta):
+    upsert_add(Appointment_Rollup, {'date': date, 'doctor_id': doctor_id, 'status': status}, 'total', delta)
+
+def bump_bookings(date, doctor_id, delta):
+    department_id = db.session.query(Doctor.department_id).filter(Doctor.id == doctor_id).scalar()
+    if department_id is not None:
+        upsert_add(Department_Rollup, {'date': date, 'department_id': department_id}, 'bookings', delta)
+
+def move_doctor_bookings(doctor_id, old_department_id, new_department_id):
+    # Department bookings follow the doctor's current department, as in rebuild_rollups(): on a move the
+    # doctor's per-date counts leave the old department and join the new one; the caller commits
+    if old_department_id == new_department_id:
+        return
+    counts = db.session.query(Appointment.date, func.count()).filter(Appointment.doctor_id == doctor_id).group_by(Appointment.date).all()
+    for department_id, sign in ((old_department_id, -1), (new_department_id, 1)):
+        if department_id is not None:
+            upsert_add_many(Department_Rollup, ['date', 'department_id'], 'bookings',
+                            [{'date': date, 'department_id': department_id, 'bookings': sign * total} for date, total in counts])
+
+def move_status(date, doctor_id, old_status, new_status, count = 1):
+    if old_status != new_status:
+        bump_status(date, doctor_id, old_status, -count)
+        bump_status(date, doctor_id, new_status, count)
+
+def record_booking(appointment):
+    bump_status(appointment.date, appointment.doctor_id, appointment.status, 1)
+    bump_bookings(appointment.date, appointment.doctor_id, 1)
+
+def record_reschedule(doctor_id, status, old_date, new_date):
+    if old_date != new_date:
+        bump_status(old_date, doctor_id, status, -1)
+        bump_status(new_date, doctor_id, status, 1)
+        bump_bookings(old_date, doctor_id, -1)
+        bump_bookings(new_date, doctor_id, 1)
+
+def transition_appointments(new_status, *criteria):
+    # Bulk status change: the affected rows are counted per (date, doctor, status) first so the
+    # rollups move by one executemany upsert instead of one statement per appointment
+    groups = db.session.query(Appointment.date, Appointment.doctor_id, Appointment.status, func.count()).filter(
+        *criteria).group_by(Appointment.date, Appointment.doctor_id, Appointment.status).all()
+    if not groups:
+        return 0
+    changed = Appointment.query.filter(*criteria).update({Appointment.status: new_status}, synchronize_session = False)
+    deltas = {}
+    for date, doctor_id, status, count in groups:
+        if status != new_status:
+            deltas[(date, doctor_id, status)] = deltas.get((date, doctor_id, status), 0) - count
+            deltas[(date, doctor_id, new_status)] = deltas.get((date, doctor_id, new_status), 0) + count
+    upsert_add_many(Appointment_Rollup, ['date', 'doctor_id', 'status'], 'total',
+                    [{'date': date, 'doctor_id': doctor_id, 'status': status, 'total': delta} for (date, doctor_id, status), delta in deltas.items()])
+    return changed
+
+def rebuild_rollups():
+    # Reconciles both rollups from the base tables in one transaction
+    db.session.query(Appointment_Rollup).delete(synchronize_session = False)
+    db.session.query(Department_Rollup).delete(synchronize_session = False)
+    db.session.execute(insert(Appointment_Rollup).from_select(
+        ['date', 'doctor_id', 'status', 'total'],
+        select(Appointment.date, Appointment.doctor_id, Appointment.status, func.count()).group_by(
+            Appointment.date, Appointment.doctor_id, Appointment.status)))
+    db.session.execute(insert(Department_Rollup).from_select(
+        ['date', 'department_id', 'bookings'],
+        select(Appointment.date, Doctor.department_id, func.count()).join(Doctor, Doctor.id == Appointment.doctor_id).where(
+            Doctor.department_id.is_not(None)).group_by(Appointment.date, Doctor.department_id)))
+    db.session.commit()
+
+def reconcile_rollups():
+    # Databases that predate the rollups are reconciled once
+    if db.session.query(Appointment_Rollup.date).first() is None and db.session.query(Appointment.id).first() is not None:
+        rebuild_rollups()
+        return True
+    return False
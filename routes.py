@@ -1,16 +1,37 @@
-from flask import render_template,request, url_for, session, flash, redirect
-from models import db, Admin, Department, Doctor, Patient, Appointment, Treatment, Doctor_Schedule
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import render_template,request, url_for, session, flash, redirect, jsonify, Response, stream_with_context
+from models import db, Admin, Department, Doctor, Patient, Appointment, Treatment, Doctor_Schedule, USER_MODELS
+from passwords import verify_password, hash_password_async, needs_rehash, hash_pool, HashingBusy
 from app import app
+from services import materialize_schedules, book_slot, reschedule_slot, earliest_free_slots, set_doctor_status, set_department_status, cancel_booking, BookingError, update_availability, AvailabilityError, BookedSlotConflict, AVAILABILITY_HORIZON_DAYS
+from cache import reference_cache
+from fragments import render_cached, bump_versions, fragment_cache
+from identity import current_identity, cached_user, invalidate_identity
+from stats import admin_statistics
+from rollups import move_status, move_doctor_bookings
+from exports import export_chunks, export_scope, parse_date, EXPORTS, FORMATS
+from search import search_records
+from slots import slots_mask, SLOT_COUNT
 from functools import wraps
 from datetime import datetime, timedelta
+from collections import namedtuple
+from sqlalchemy.orm import Session, joinedload, selectinload
 
 #Functions and decorators used for efficiency
+@app.errorhandler(HashingBusy)
+def hashing_busy(e):
+    flash('The server is busy, kindly try again in a moment.')
+    return redirect(request.url)
+
 def login_auth(func):
     @wraps(func)
     def inner(*args, **kwargs):
         if 'user_id' in session:
-            return func(*args, **kwargs)
+            user = current_identity()
+            if user and user.status != 'Inactive':
+                return func(*args, **kwargs)
+            session.clear()
+            flash('Your account has been deactivated. Kindly contact the admin.')
+            return redirect(url_for('home'))
         else:
             flash ('Kindly login to continue')
             return redirect(url_for('home'))
@@ -47,52 +68,90 @@ def doc_auth(func):
     return inner2
 
 def fetch_user_by_username(username, role):
-    if role == 'admin':
-        user = Admin.query.filter_by(username=username).first()
-    elif role == 'doctor':
-        user = Doctor.query.filter_by(username=username).first()
-    elif role == 'patient':
-        user = Patient.query.filter_by(username=username).first()
-    return user
+    return USER_MODELS[role].query.filter_by(username=username).first()
 
 def fetch_user_by_id(id, role):
-    if role == 'admin':
-        user = Admin.query.filter_by(id=id).first()
-    elif role == 'doctor':
-        user = Doctor.query.filter_by(id=id).first()
-    elif role == 'patient':
-        user = Patient.query.filter_by(id=id).first()
-    return user
-
-def remove_outdated_entities(doctor_id):
-    today = datetime.now().date()
-    schedules = Doctor_Schedule.query.filter(Doctor_Schedule.doctor_id == doctor_id, Doctor_Schedule.date < today).all()
-    for schedule in schedules:
-        db.session.delete(schedule)
-    appointments = Appointment.query.filter(Appointment.date < today).all()
-    for appointment in appointments:
-        appointment.status = 'Missed'
-    db.session.commit()
-
-def add_new_schedules(doctor_id):
-    today = datetime.now().date()
-    last_schedule = Doctor_Schedule.query.filter_by(doctor_id = doctor_id).order_by(Doctor_Schedule.date.desc()).first()
-    if last_schedule:
-        last_date = last_schedule.date
-        gap = (last_date - today).days
-    
-        if gap < 7:
-            for i in range(7 - gap):
-                date = last_date + timedelta(days = i + 1)
-                new_schedule = Doctor_Schedule(doctor_id = doctor_id, date = date, status = True)
-                db.session.add(new_schedule)
-            db.session.commit()
+    return USER_MODELS[role].query.filter_by(id=id).first()
+
+def fetch_appointments():
+    # Loads every relation the appointment templates walk in the same SELECT
+    return Appointment.query.options(
+        joinedload(Appointment.doctor).joinedload(Doctor.department),
+        joinedload(Appointment.patient),
+        joinedload(Appointment.treatment))
+
+Page = namedtuple('Page', ['items', 'prev_url', 'next_url'])
+
+def page_bounds():
+    # The only query arguments a list page depends on, normalised so stray ones cannot multiply cache entries
+    limit = request.args.get('limit', app.config['PAGE_SIZE'], type = int)
+    limit = max(1, min(limit, app.config['MAX_PAGE_SIZE']))
+    return request.args.get('after', type = int), request.args.get('before', type = int), limit
+
+def paginate(query, column, keep_args = True):
+    # Keyset pagination: seeks past ?after=<id> (or before ?before=<id>) instead of using OFFSET.
+    # Cached pages pass keep_args = False so their links carry only the page size, not the first visitor's query string
+    after, before, limit = page_bounds()
+
+    if before is not None:
+        items = query.filter(column < before).order_by(column.desc()).limit(limit + 1).all()
+        has_more = len(items) > limit
+        items = items[:limit][::-1]
+        has_prev, has_next = has_more, True
     else:
-        for i in range(8):
-            date = today + timedelta(days = i)
-            new_schedule = Doctor_Schedule(doctor_id = doctor_id, date = date, status = True)
-            db.session.add(new_schedule)
-        db.session.commit()
+        if after is not None:
+            query = query.filter(column > after)
+        items = query.order_by(column.asc()).limit(limit + 1).all()
+        has_more = len(items) > limit
+        items = items[:limit]
+        has_prev, has_next = after is not None, has_more
+
+    if keep_args:
+        args = request.args.to_dict()
+        args.pop('after', None)
+        args.pop('before', None)
+    else:
+        args = {'limit': limit} if limit != app.config['PAGE_SIZE'] else {}
+    args.update(request.view_args)
+    prev_url = next_url = None
+    if items and has_prev:
+        prev_url = url_for(request.endpoint, before = items[0].id, **args)
+    if items and has_next:
+        next_url = url_for(request.endpoint, after = items[-1].id, **args)
+    return Page(items, prev_url, next_url)
+
+# Department and doctor pages show both tables, so they depend on both versions
+REFERENCE_VERSIONS = ('departments', 'doctors')
+
+def cached(key, loader):
+    # The loader runs in a private session that is closed right away, so cached rows are
+    # detached with their eager-loaded relations and never expired by a request's commit
+    def load():
+        with Session(db.engine) as private:
+            return loader(private)
+    return reference_cache.get(key, load)
+
+def invalidate_departments():
+    reference_cache.invalidate('departments', 'top_departments', 'doctors', 'top_doctors')
+    bump_versions(*REFERENCE_VERSIONS)
+
+def invalidate_doctors():
+    reference_cache.invalidate('doctors', 'top_doctors', 'departments', 'top_departments')
+    bump_versions(*REFERENCE_VERSIONS)
+
+def all_departments():
+    return cached(('departments', 'all'), lambda s: s.query(Department).order_by(Department.id.asc()).all())
+
+def top_departments():
+    return cached(('top_departments',), lambda s: s.query(Department).filter_by(status = 'Active').options(selectinload(Department.doctors)).order_by(Department.id.asc()).limit(3).all())
+
+def fetch_schedules(doctor_id, days = None):
+    # Past schedules are left to the nightly sweep, so only upcoming days (the next `days` of them, if given) are read here
+    today = datetime.now().date()
+    query = Doctor_Schedule.query.filter(Doctor_Schedule.doctor_id == doctor_id, Doctor_Schedule.date >= today)
+    if days is not None:
+        query = query.filter(Doctor_Schedule.date < today + timedelta(days = days))
+    return query.order_by(Doctor_Schedule.date.asc()).all()
 
 #Routes/Controllers
 #common routes
@@ -139,11 +198,15 @@ def login(role):
             flash (f'User does not exist')
             return redirect(url_for('login', role = role))
         
-        if role == 'doctor' and user.status == 'Inactive':
+        if user.status == 'Inactive':
             flash('Your account has been deactivated. Kindly contact the admin.')
             return redirect(url_for('login', role = role))
 
-        if user and check_password_hash(user.passhash, password):
+        if verify_password(user.passhash, password):
+            if needs_rehash(user.passhash):
+                # The hashing parameters changed since this password was stored; upgrade it now that we have the plaintext
+                user.passhash = hash_password_async(password)
+                db.session.commit()
             session['role'] = role
             session['user_id'] = user.id
             session['username'] = user.username
@@ -164,7 +227,7 @@ def dashboard():
 @app.route('/profile/<role>/<id>')
 @login_auth
 def profile(id, role):
-    user = fetch_user_by_id(id, role)
+    user = cached_user(role, id)
     return render_template('profile.html', user = user, role = role)
 
 @app.route('/profile/edit/<role>/<id>', methods = ['GET', 'POST'])
@@ -175,7 +238,7 @@ def edit_profile(id, role):
         if session['role'] == 'admin' or session['role'] == role:
             user = fetch_user_by_id(id, role)
             if role == 'doctor':
-                departments = Department.query.all()
+                departments = all_departments()
                 return render_template('edit_profile.html', user = user, role = role, departments = departments)
             else:    
                 return render_template('edit_profile.html', user = user, role = role)
@@ -202,9 +265,10 @@ def edit_profile(id, role):
                 return redirect(url_for('edit_profile', role = role, id = id))
         
         if role == 'doctor':
-            department_id = request.form.get('department_id')
+            department_id = request.form.get('department_id', type = int)
             description = request.form.get('description')
 
+            move_doctor_bookings(user.id, user.department_id, department_id)
             user.department_id = department_id
             user.description = description
 
@@ -213,6 +277,11 @@ def edit_profile(id, role):
         user.contact = contact
         user.address = address
         db.session.commit()
+        invalidate_identity(role, user.id)
+        if role == 'doctor':
+            invalidate_doctors()
+        elif role == 'patient':
+            reference_cache.invalidate('top_patients')
 
         flash("Profile updated successfully.")
         return redirect(url_for('profile', id = user.id, role = role))
@@ -225,17 +294,13 @@ def search():
     category = request.args.get('category')
 
     if category == 'doctor':
-        results = Doctor.query.filter(Doctor.name.ilike(f'%{query}%')).all()
-        return render_template('doctor/doctors.html', doctors = results)
+        return render_template('doctor/doctors.html', doctors = search_records(category, query))
     elif category == 'patient':
-        results = Patient.query.filter(Patient.name.ilike(f'%{query}%')).all()
-        return render_template('patient/patients.html', patients = results)
+        return render_template('patient/patients.html', patients = search_records(category, query))
     elif category == 'admin':
-        results = Admin.query.filter(Admin.name.ilike(f'%{query}%')).all()
-        return render_template('admin/admins.html', admins = results)
+        return render_template('admin/admins.html', admins = search_records(category, query))
     elif category == 'department':
-        results = Department.query.filter(Department.name.ilike(f'%{query}%')).all()
-        return render_template('department/departments.html', departments = results)
+        return render_template('department/departments.html', departments = search_records(category, query))
 
 #Department related routes  
 
@@ -259,18 +324,21 @@ def add_department():
             new_department = Department(name = name, description = description)
             db.session.add(new_department)
             db.session.commit() 
+            invalidate_departments()
 
             flash ("Department addedd successfully")
             return redirect(url_for('admin_dashboard'))
         
 @app.route('/department/view/<int:id>')
 def view_department(id):
-    department = Department.query.filter_by(id = id).first()
-    if session['role'] == 'patient':
-        doctors = Doctor.query.filter_by(department_id = id, status = 'Active').all()
-    else:
-        doctors = Doctor.query.all()
-    return render_template("department/view_department.html", department = department, doctors = doctors)
+    def load():
+        department = Department.query.filter_by(id = id).first()
+        if session['role'] == 'patient':
+            doctors = Doctor.query.filter_by(department_id = id, status = 'Active').all()
+        else:
+            doctors = Doctor.query.all()
+        return {'department': department, 'doctors': doctors}
+    return render_cached("department/view_department.html", REFERENCE_VERSIONS, load, key = request.path)
     
 @app.route('/department/edit/<int:id>', methods = ['GET', 'POST'])
 @login_auth
@@ -299,6 +367,7 @@ def edit_department(id):
         department.name = name
         department.description = description
         db.session.commit()
+        invalidate_departments()
 
         flash("Department updated successfully.")
         return redirect(url_for('view_department', id = id))
@@ -307,8 +376,10 @@ def edit_department(id):
 @login_auth
 def departments():
     if request.method == 'GET':
-        departments = Department.query.all()
-        return render_template('department/departments.html', departments = departments)
+        def load():
+            page = paginate(Department.query.options(selectinload(Department.doctors)), Department.id, keep_args = False)
+            return {'departments': page.items, 'page': page}
+        return render_cached('department/departments.html', REFERENCE_VERSIONS, load, key = page_bounds())
     
     if request.method == 'POST':
         department_id = request.form.get('department_id')
@@ -320,6 +391,27 @@ def departments():
         department = Department.query.filter_by(id = department_id).first()
         return render_template('department/departments.html', doctors = doctors, department = department)     
 
+@app.route('/department/<int:id>/earliest_slots')
+@login_auth
+def earliest_slots(id):
+    visit_type = request.args.get('visit_type', 'In-Person')
+    if visit_type not in ['In-Person', 'Virtual']:
+        return jsonify(error = 'visit_type must be In-Person or Virtual.'), 400
+    try:
+        start = request.args.get('from')
+        end = request.args.get('to')
+        start = datetime.strptime(start, "%Y-%m-%d").date() if start else None
+        end = datetime.strptime(end, "%Y-%m-%d").date() if end else None
+    except ValueError:
+        return jsonify(error = 'Dates must use the YYYY-MM-DD format.'), 400
+    limit = max(1, min(request.args.get('limit', 10, type = int), app.config['MAX_PAGE_SIZE']))
+
+    slots = earliest_free_slots(id, start, end, limit)
+    for slot in slots:
+        slot['selected_slot'] = f"{slot['schedule_id']}_{slot['slot']}"
+        slot['book_url'] = url_for('book_appointment', doctor_id = slot['doctor_id'])
+    return jsonify(department_id = id, visit_type = visit_type, slots = slots)
+
 @app.route('/department/<int:id>/status_change', methods = ['GET', 'POST'])
 @login_auth
 @admin_auth
@@ -330,21 +422,11 @@ def change_department_status(id):
 
     if request.method == 'POST':
         department = Department.query.filter_by(id = id).first()
-        if department.status == 'Active':
-            department.status = 'Inactive'
-        else:
-            department.status = 'Active'
-        doctors = Doctor.query.filter_by(department_id = id).all()
-        for doctor in doctors:
-            if department.status == 'Inactive':
-                doctor.status = 'Inactive'
-                appointments = Appointment.query.filter_by(doctor_id = id, status = 'Booked').all()
-                for appointment in appointments:
-                    appointment.status = 'Cancelled'
-            else:
-                doctor.status = 'Active'
-        db.session.commit()
-        flash('Department status changes successfully.')
+        status = 'Inactive' if department.status == 'Active' else 'Active'
+        counts = set_department_status(id, status)
+        invalidate_departments()
+        invalidate_identity()
+        flash(f"Department status changes successfully. {counts['doctors']} doctors updated, {counts['appointments']} upcoming appointments cancelled.")
         return redirect(url_for('admin_dashboard'))
 
 #Doctor related routes
@@ -352,9 +434,10 @@ def change_department_status(id):
 @app.route('/doctor_dashboard')
 @login_auth
 def doctor_dashboard():
-    doctor = fetch_user_by_id(session['user_id'], 'doctor')
-    appointments = Appointment.query.filter_by(doctor_id = doctor.id, status = 'Booked').all()
-    treated_patients = Patient.query.join(Appointment, Appointment.patient_id == Patient.id).filter(Appointment.doctor_id == doctor.id,Appointment.status == "Completed").distinct().all()
+    doctor = current_identity()
+    appointments = fetch_appointments().filter(Appointment.doctor_id == doctor.id, Appointment.status == 'Booked').all()
+    treated = db.session.query(Appointment.patient_id).filter(Appointment.doctor_id == doctor.id, Appointment.status == 'Completed')
+    treated_patients = Patient.query.filter(Patient.id.in_(treated)).order_by(Patient.id.asc()).all()
     return render_template('doctor/doctor_dashboard.html', doctor = doctor, appointments = appointments, treated_patients= treated_patients)
 
 @app.route('/<int:id>/doctor/add', methods = ["GET", "POST"])
@@ -362,7 +445,7 @@ def doctor_dashboard():
 @admin_auth
 def add_doctor(id):
     if request.method == "GET":
-        departments = Department.query.all()
+        departments = all_departments()
         return render_template('doctor/add_doctor.html', departments = departments, id = id)
     
     if request.method == "POST":
@@ -380,15 +463,11 @@ def add_doctor(id):
             flash ("This Doctor is already registered.")
             return redirect(url_for("add_doctor"))
         else:
-            new_doctor = Doctor(username = username, passhash = generate_password_hash(password), name = name, address = address, contact = contact, department_id = department_id, description = description)
+            new_doctor = Doctor(username = username, passhash = hash_password_async(password), name = name, address = address, contact = contact, department_id = department_id, description = description)
             db.session.add(new_doctor)
             db.session.commit()
-
-            doc = fetch_user_by_username(username, 'doctor')
-            for i in range(8):
-                new_schedule = Doctor_Schedule(doctor_id = doc.id, date = datetime.now().date() + timedelta(days = i), status = True)
-                db.session.add(new_schedule)
-                db.session.commit()
+            materialize_schedules([new_doctor.id])
+            invalidate_doctors()
 
             flash ("Doctor added successfully")
             return redirect(url_for('admin_dashboard'))
@@ -397,11 +476,14 @@ def add_doctor(id):
 @login_auth
 def doctors():
     if request.method == 'GET':
-        if session['role'] == 'patient':
-            doctors = Doctor.query.filter_by(status ='Active').all()
-        else:
-            doctors = Doctor.query.all()
-        return render_template('doctor/doctors.html', doctors = doctors)
+        active_only = session['role'] == 'patient'
+        def load():
+            doctors = Doctor.query.options(joinedload(Doctor.department))
+            if active_only:
+                doctors = doctors.filter_by(status ='Active')
+            page = paginate(doctors, Doctor.id, keep_args = False)
+            return {'doctors': page.items, 'page': page}
+        return render_cached('doctor/doctors.html', REFERENCE_VERSIONS, load, key = page_bounds())
 
 
 @app.route('/doctor/<int:id>/status_change', methods = ['GET', 'POST'])
@@ -414,41 +496,76 @@ def change_doctor_status(id):
 
     if request.method == 'POST':
         doctor = Doctor.query.filter_by(id = id).first()
-        if doctor.status == 'Active':
-            doctor.status = 'Inactive'
-            appointments = Appointment.query.filter_by(doctor_id = id, status = 'Booked').all()
-            for appointment in appointments:
-                appointment.status = 'Cancelled'
-        else:
-            doctor.status = 'Active'
-        db.session.commit()
-        flash('Doctor status changed successfully.')
+        status = 'Inactive' if doctor.status == 'Active' else 'Active'
+        counts = set_doctor_status(id, status)
+        invalidate_doctors()
+        invalidate_identity('doctor', id)
+        flash(f"Doctor status changed successfully. {counts['appointments']} upcoming appointments cancelled.")
         return redirect(url_for('admin_dashboard'))
 
+def availability_from_json(payload):
+    # {"days": {"YYYY-MM-DD": [open slot numbers], ...}}; a day left out is not touched
+    days = payload.get('days') if isinstance(payload, dict) else None
+    if not isinstance(days, dict) or not days:
+        raise ValueError('Send {"days": {"YYYY-MM-DD": [slot numbers]}}.')
+    masks = {}
+    for date, slot_numbers in days.items():
+        if not isinstance(slot_numbers, list) or not all(isinstance(n, int) for n in slot_numbers):
+            raise ValueError(f'Slots for {date} must be a list of slot numbers.')
+        try:
+            date = datetime.strptime(date, "%Y-%m-%d").date()
+        except ValueError:
+            raise ValueError('Dates must use the YYYY-MM-DD format.')
+        masks[date] = slots_mask(slot_numbers)
+    return masks
+
+def summarize_availability(diff):
+    opened = sum(len(day['opened']) for day in diff)
+    closed = sum(len(day['closed']) for day in diff)
+    return f'{opened} slots opened and {closed} closed across {len(diff)} days.'
+
 @app.route('/doctor_id=<int:id>/availability', methods = ['GET', 'POST'])
 @login_auth
 def doctor_availability(id):
-    if session['role'] == 'patient':
+    if session['role'] == 'patient' or (request.method == 'POST' and session['role'] == 'doctor' and session['user_id'] != id):
+        if request.is_json:
+            return jsonify(error = 'Access Denied.'), 403
         flash('Access Denied.')
         return redirect(url_for('home'))
                         
     if request.method == 'GET':
         doctor = fetch_user_by_id(id, 'doctor')
-        remove_outdated_entities(id)
-        add_new_schedules(id)
-        schedules = Doctor_Schedule.query.filter_by(doctor_id = id).all()
+        materialize_schedules([id])
+        # The form lists, and saves, only the days update_availability() accepts
+        schedules = fetch_schedules(id, AVAILABILITY_HORIZON_DAYS)
         return render_template('doctor/availability.html', schedules = schedules, doctor = doctor)
     
+    if request.method == 'POST' and request.is_json:
+        try:
+            diff = update_availability(id, availability_from_json(request.get_json(silent = True)))
+        except ValueError as e:
+            return jsonify(error = str(e)), 400
+        except BookedSlotConflict as e:
+            return jsonify(error = e.message, conflicts = e.conflicts), 409
+        except AvailabilityError as e:
+            return jsonify(error = e.message), 400
+        return jsonify(doctor_id = id, changes = diff)
+
     if request.method == 'POST':
-        schedules = Doctor_Schedule.query.filter_by(doctor_id = id).all()
-        for schedule in schedules:
-            slot1_key = f'slot1-{schedule.id}'
-            slot2_key = f'slot2-{schedule.id}'
-            schedule.slot_1 = slot1_key in request.form
-            schedule.slot_2 = slot2_key in request.form
-            db.session.commit()
+        # The form carries every upcoming day on the page, checked boxes being the open slots
+        days = {schedule.date: slots_mask(n for n in range(1, SLOT_COUNT + 1) if f'slot{n}-{schedule.id}' in request.form)
+                for schedule in fetch_schedules(id, AVAILABILITY_HORIZON_DAYS)}
+        try:
+            diff = update_availability(id, days)
+        except BookedSlotConflict as e:
+            booked = '; '.join(f"{day['date']}: slot {', '.join(map(str, day['slots']))}" for day in e.conflicts)
+            flash(f'{e.message} ({booked})')
+            return redirect(url_for('doctor_availability', id = id))
+        except AvailabilityError as e:
+            flash(e.message)
+            return redirect(url_for('doctor_availability', id = id))
         
-        flash('Availability updated successfully.')
+        flash(f'Availability updated successfully. {summarize_availability(diff)}')
         return redirect(url_for('doctor_dashboard'))
 
 #Patient related routes
@@ -457,15 +574,15 @@ def doctor_availability(id):
 @login_auth
 def patients():
     if request.method == 'GET':
-        patients = Patient.query.all()
-        return render_template('patient/patients.html', patients = patients)
+        page = paginate(Patient.query, Patient.id)
+        return render_template('patient/patients.html', patients = page.items, page = page)
 
 @app.route('/patient_dashboard')
 @login_auth
 def patient_dashboard():
-    patient = fetch_user_by_id(session['user_id'], 'patient')
-    departments = Department.query.filter_by(status = 'Active').order_by(Department.id.asc()).limit(3).all()
-    appointments = Appointment.query.filter_by(patient_id = patient.id, status = 'Booked').all()
+    patient = current_identity()
+    departments = top_departments()
+    appointments = fetch_appointments().filter(Appointment.patient_id == patient.id, Appointment.status == 'Booked').all()
     return render_template('patient/patient_dashboard.html', patient = patient, appointments = appointments,departments = departments)
 
 @app.route('/register', methods = ['GET', 'POST'])
@@ -496,12 +613,13 @@ def register():
             flash ('This username already exists, kindly use a different username')
             return redirect(url_for('register'))
 
-        password_hash = generate_password_hash(password)
+        password_hash = hash_password_async(password)
 
         new_user = Patient(username = username, passhash=password_hash, name = name, address = address, contact = contact)
         
         db.session.add(new_user)
         db.session.commit()
+        reference_cache.invalidate('top_patients')
 
         flash("Registration complete. Kindly login.")
         return(redirect(url_for('login', role = 'patient')))
@@ -511,8 +629,10 @@ def register():
 def treatment_history(id):
     if request.method == 'GET':
         patient = fetch_user_by_id(id, 'patient')
-        treatments = Treatment.query.filter_by(patient_id = id).all()
-        return render_template('patient/history.html', treatments = treatments, id = id)
+        treatments = Treatment.query.filter_by(patient_id = id).options(
+            joinedload(Treatment.appointment).joinedload(Appointment.doctor).joinedload(Doctor.department))
+        page = paginate(treatments, Treatment.id)
+        return render_template('patient/history.html', treatments = page.items, id = id, page = page)
     
 @app.route('/patient/treatment/add/<appointment_id>', methods = ['GET', 'POST'])
 @login_auth
@@ -536,6 +656,7 @@ def add_treatment(appointment_id):
             flash('Please fill out all the fields.')
             return redirect(url_for('add_treatment', appointment_id = appointment_id))
         
+        move_status(appointment.date, appointment.doctor_id, appointment.status, 'Completed')
         appointment.status = 'Completed'
 
         new_treatment = Treatment(appointment_id = appointment_id, doctor_id = doctor_id, patient_id = patient_id, diagnosis = diagnosis, treatment = treatment, instruction = instruction)
@@ -569,6 +690,8 @@ def change_patient_status(id):
         else:
             patient.status = 'Active'
         db.session.commit()
+        reference_cache.invalidate('top_patients')
+        invalidate_identity('patient', id)
         flash("Patient's status changed successfully.")
         return redirect(url_for('admin_dashboard'))
 
@@ -578,19 +701,31 @@ def change_patient_status(id):
 @login_auth
 @admin_auth
 def admin_dashboard():
-    departments = Department.query.filter_by(status = 'Active').order_by(Department.id.asc()).limit(3).all()
-    doctors = Doctor.query.filter_by(status = 'Active').order_by(Doctor.id.asc()).limit(3).all()
-    patients = Patient.query.filter_by(status = 'Active').order_by(Patient.id.asc()).limit(3).all()
-    appointments = Appointment.query.filter_by(status = 'Booked').order_by(Appointment.id.asc()).limit(3).all()
-    return render_template('admin/admin_dashboard.html', departments = departments, doctors = doctors, patients = patients, appointments = appointments)
+    departments = top_departments()
+    doctors = cached(('top_doctors',), lambda s: s.query(Doctor).filter_by(status = 'Active').options(joinedload(Doctor.department)).order_by(Doctor.id.asc()).limit(3).all())
+    patients = cached(('top_patients',), lambda s: s.query(Patient).filter_by(status = 'Active').order_by(Patient.id.asc()).limit(3).all())
+    appointments = fetch_appointments().filter(Appointment.status == 'Booked').order_by(Appointment.id.asc()).limit(3).all()
+    return render_template('admin/admin_dashboard.html', departments = departments, doctors = doctors, patients = patients, appointments = appointments, stats = admin_statistics())
 
 @app.route('/admins', methods = ['GET', 'POST'])
 @login_auth
 @admin_auth
 def admins():
     if request.method == 'GET':
-        admins = Admin.query.all()
-        return render_template('admin/admins.html', admins = admins)
+        page = paginate(Admin.query, Admin.id)
+        return render_template('admin/admins.html', admins = page.items, page = page)
+
+@app.route('/admin/cache_stats')
+@login_auth
+@admin_auth
+def cache_stats():
+    return jsonify(reference_cache.stats() | {'fragments': fragment_cache.stats()})
+
+@app.route('/admin/hash_stats')
+@login_auth
+@admin_auth
+def hash_stats():
+    return jsonify(hash_pool.stats())
 
 @app.route('/admin/add', methods = ['GET', 'POST'])
 @login_auth
@@ -621,7 +756,7 @@ def add_admin():
             flash ('This username already exists, kindly use a different username')
             return redirect(url_for('add_admin'))
 
-        password_hash = generate_password_hash(password)
+        password_hash = hash_password_async(password)
 
         new_admin = Admin(username = username, passhash=password_hash, name = name, address = address, contact = contact)
         
@@ -646,6 +781,7 @@ def change_admin_status(id):
         else:
             admin.status = 'Active'
         db.session.commit()
+        invalidate_identity('admin', id)
         flash('Admin status changed successfully.')
         return redirect(url_for('admin_dashboard'))
 
@@ -658,8 +794,7 @@ def change_admin_status(id):
 def book_appointment(doctor_id):
     if request.method == 'GET':
         doctor = fetch_user_by_id(doctor_id, 'doctor')
-        remove_outdated_entities(doctor_id)
-        schedules = Doctor_Schedule.query.filter_by(doctor_id = doctor.id).all()
+        schedules = fetch_schedules(doctor.id)
         return render_template('appointment/book_appointment.html', doctor = doctor, schedules = schedules)
 
     if request.method == 'POST':
@@ -670,41 +805,22 @@ def book_appointment(doctor_id):
 
         selected_slot = request.form.get('selected_slot')
         if not selected_slot:
-            schedules = Doctor_Schedule.query.filter_by(doctor_id = doctor_id).all()
             flash('Please select a slot from the available options.')
-            return redirect(url_for('book_appointment', doctor_id = doctor_id, schedules = schedules))
+            return redirect(url_for('book_appointment', doctor_id = doctor_id))
         
         slot_id = int(selected_slot.split('_')[0])
         slot_number = int(selected_slot.split('_')[1])
 
         visit_type = request.form.get('visit_type')
         if not visit_type:
-            schedules = Doctor_Schedule.query.filter_by(doctor_id = doctor_id).all()
             flash('Please select a visit type.')
-            return redirect(url_for('book_appointment', doctor_id = doctor_id, schedules = schedules))
-
-        schedule = Doctor_Schedule.query.filter_by(id = slot_id).first()
-
-        if slot_number == 1:
-            if schedule.slot_1 == False:
-                schedules = Doctor_Schedule.query.filter_by(doctor_id = doctor_id).all()
-                flash('Selected slot is no longer available. Please choose a different slot.')
-                return redirect(url_for('book_appointment', doctor_id = doctor_id, schedules = schedules))
-            else:
-                schedule.slot_1 = False
-        elif slot_number == 2:
-            if schedule.slot_2 == False:
-                schedules = Doctor_Schedule.query.filter_by(doctor_id = doctor_id).all()
-                flash('Selected slot is no longer available. Please choose a different slot.')
-                return redirect(url_for('book_appointment', doctor_id = doctor_id, schedules = schedules))
-            else:
-                schedule.slot_2 = False
-
-        appointment_date = schedule.date
-        status = 'Booked'
-        new_appointment = Appointment(patient_id = patient_id, doctor_id = doctor_id, visit_type = visit_type, date = appointment_date, slot = slot_number, status = status)
-        db.session.add(new_appointment)
-        db.session.commit()
+            return redirect(url_for('book_appointment', doctor_id = doctor_id))
+
+        try:
+            book_slot(int(patient_id), int(doctor_id), slot_id, slot_number, visit_type)
+        except BookingError as error:
+            flash(error.message)
+            return redirect(url_for('book_appointment', doctor_id = doctor_id))
 
         flash('Appointment booked successfully.')
         return redirect(url_for('patient_dashboard'))
@@ -715,7 +831,7 @@ def reschedule_appointment(id):
     if request.method == 'GET':
         appointment = Appointment.query.filter_by(id = id).first()
         if appointment.status == 'Booked':
-            schedules = Doctor_Schedule.query.filter_by(doctor_id = appointment.doctor.id).all()
+            schedules = fetch_schedules(appointment.doctor_id)
             return render_template('appointment/reschedule_appointment.html', appointment = appointment, schedules = schedules)
         else:
             flash("That appointment is cancelled. Kindly book another appointment.")
@@ -723,35 +839,24 @@ def reschedule_appointment(id):
 
     if request.method == 'POST':
         appointment = Appointment.query.filter_by(id = id).first()
+        if appointment.status != 'Booked':
+            flash("That appointment is cancelled. Kindly book another appointment.")
+            return redirect(url_for('patient_dashboard'))
+
         selected_slot = request.form.get('selected_slot')
         if not selected_slot:
-            schedules = Doctor_Schedule.query.filter_by(doctor_id = appointment.doctor.id).all()
             flash('Please select a slot from the available options.')
             return redirect(url_for('reschedule_appointment', id = id))
         
         slot_id = int(selected_slot.split('_')[0])
         slot_number = int(selected_slot.split('_')[1])
 
-        schedule = Doctor_Schedule.query.filter_by(id = slot_id).first()
-        if slot_number == 1:
-            schedule.slot_1 = False
-        elif slot_number == 2:
-            schedule.slot_2 = False
-
-        old_schedule = Doctor_Schedule.query.filter_by(doctor_id = appointment.doctor.id, date = appointment.date)
-        if old_schedule:
-            if appointment.slot == 1: 
-                schedule.slot_1 == True 
-            elif appointment.slot == 2: 
-                schedule.slot_2 = True
-        else:
-            pass
-
-        appointment.date = schedule.date
-        appointment.status = 'Booked'
-        appointment.slot = slot_number
+        try:
+            reschedule_slot(appointment, slot_id, slot_number)
+        except BookingError as error:
+            flash(error.message)
+            return redirect(url_for('reschedule_appointment', id = id))
 
-        db.session.commit()
         flash('Appointment rescheduled successfully.')
         return redirect(url_for('patient_dashboard'))
 
@@ -759,8 +864,7 @@ def reschedule_appointment(id):
 @login_auth
 def cancel_appointment(id):
     appointment = Appointment.query.filter_by(id = id).first()
-    appointment.status = 'Cancelled'
-    db.session.commit()
+    cancel_booking(appointment)
 
     flash('Appointment cancelled successfully.')
     return redirect(url_for(f'{session['role']}_dashboard'))
@@ -771,21 +875,40 @@ def cancel_appointment(id):
 def appointments(role, id):
     if request.method == 'GET':
         str_date = request.args.get('date')
-        if not str_date:
-            if role == 'doctor':
-                appointments = Appointment.query.filter_by(doctor_id = id).all()
-            elif role == 'patient':
-                appointments = Appointment.query.filter_by(patient_id = id).all()
-            elif role == 'admin':
-                appointments = Appointment.query.all()
-            return render_template('appointment/appointments.html', appointments = appointments, role = role, id = id)
-        
+        appointments = fetch_appointments()
+        if role == 'doctor':
+            appointments = appointments.filter(Appointment.doctor_id == id)
+        elif role == 'patient':
+            appointments = appointments.filter(Appointment.patient_id == id)
+
         if str_date:
             date = datetime.strptime(str_date, "%Y-%m-%d").date()
-            if role == 'doctor':
-                appointments = Appointment.query.filter_by(doctor_id = id, date = date).all()
-            elif role == 'patient':
-                appointments = Appointment.query.filter_by(patient_id = id, date = date).all()
-            elif role == 'admin':
-                appointments = Appointment.query.filter_by(date = date).all()
-            return render_template('appointment/appointments.html', appointments = appointments, role = role, id = id)
+            appointments = appointments.filter(Appointment.date == date)
+
+        page = paginate(appointments, Appointment.id)
+        return render_template('appointment/appointments.html', appointments = page.items, role = role, id = id, page = page)
+
+#Export routes
+
+@app.route('/export/<entity>')
+@login_auth
+def export(entity):
+    format = request.args.get('format', 'csv')
+    if entity not in EXPORTS or format not in FORMATS:
+        flash('Unknown export.')
+        return redirect(url_for('home'))
+
+    scope = export_scope(entity, session['role'], session['user_id'], request.args.get('role'), request.args.get('id', type = int))
+    if scope is None:
+        flash("Access Denied.")
+        return redirect(url_for("home"))
+    role, id = scope
+    try:
+        date = parse_date(request.args.get('date'))
+    except ValueError:
+        flash('Dates must use the YYYY-MM-DD format.')
+        return redirect(url_for('home'))
+
+    chunks = export_chunks(entity, format, role, id, date)
+    headers = {'Content-Disposition': f'attachment; filename={entity}.{format}'}
+    return Response(stream_with_context(chunks), mimetype = FORMATS[format], headers = headers)
@@ -0,0 +1,106 @@
+from app import app
+from models import db, Admin, Department, Doctor, Patient
+from sqlalchemy import text
+from sqlalchemy.orm import joinedload
+
+#Indexed search: SQLite FTS5 trigram indexes over each searchable table, kept in sync by triggers
+SEARCH_FIELDS = {
+    'doctor': (Doctor, ['name', 'username', 'contact', 'description']),
+    'patient': (Patient, ['name', 'username', 'contact']),
+    'admin': (Admin, ['name', 'username', 'contact']),
+    'department': (Department, ['name', 'description']),
+}
+
+# bm25 column weights, in field order: a name hit outranks the other fields
+NAME_WEIGHT = 10.0
+OTHER_WEIGHT = 2.0
+
+def fts_enabled():
+    return db.engine.dialect.name == 'sqlite'
+
+def fts_table(model):
+    return f'{model.__tablename__}_Search'
+
+def create_search_index(rebuild = False):
+    # Creates the external-content FTS tables and triggers once; existing rows are indexed on creation
+    if not fts_enabled():
+        return
+    with db.engine.begin() as conn:
+        for model, fields in SEARCH_FIELDS.values():
+            table, fts = model.__tablename__, fts_table(model)
+            exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': fts}).first()
+            if exists and not rebuild:
+                continue
+            cols = ', '.join(fields)
+            new_cols = ', '.join(f'new.{field}' for field in fields)
+            old_cols = ', '.join(f'old.{field}' for field in fields)
+            conn.execute(text(f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({cols}, content = '{table}', content_rowid = 'id', tokenize = 'trigram')"))
+            conn.execute(text(f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+                              f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new_cols}); END"))
+            conn.execute(text(f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+                              f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_cols}); END"))
+            conn.execute(text(f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {cols} ON {table} BEGIN "
+                              f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_cols}); "
+                              f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new_cols}); END"))
+            conn.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+
+def quote(term):
+    return '"' + term.replace('"', '""') + '"'
+
+def trigrams(query):
+    grams = []
+    for word in query.lower().split():
+        for i in range(len(word) - 2):
+            if word[i:i + 3] not in grams:
+                grams.append(word[i:i + 3])
+    return grams
+
+def ranked_ids(model, fields, match, limit):
+    fts = fts_table(model)
+    weights = ', '.join([str(NAME_WEIGHT)] + [str(OTHER_WEIGHT)] * (len(fields) - 1))
+    rows = db.session.execute(text(f"SELECT rowid FROM {fts} WHERE {fts} MATCH :match ORDER BY bm25({fts}, {weights}) LIMIT :limit"),
+                              {'match': match, 'limit': limit})
+    return [rowid for (rowid,) in rows]
+
+def fuzzy_ids(model, grams, limit):
+    # Ranks rows by how many of the query's trigrams they contain
+    fts = fts_table(model)
+    union = ' UNION ALL '.join(f"SELECT rowid FROM {fts} WHERE {fts} MATCH :g{i}" for i in range(len(grams)))
+    params = {f'g{i}': quote(gram) for i, gram in enumerate(grams)}
+    params['limit'] = limit
+    params['needed'] = max(2, len(grams) // 2)
+    rows = db.session.execute(text(f"SELECT rowid FROM ({union}) GROUP BY rowid HAVING count(*) >= :needed "
+                                   f"ORDER BY count(*) DESC, rowid ASC LIMIT :limit"), params)
+    return [rowid for (rowid,) in rows]
+
+def search_ids(category, query, limit):
+    # Substring (and so prefix) matches win; when there are none the query is treated as a typo
+    # and rows sharing at least half of its trigrams are returned, best overlap first
+    model, fields = SEARCH_FIELDS[category]
+    ids = ranked_ids(model, fields, quote(query), limit)
+    grams = trigrams(query)
+    if not ids and len(grams) > 1:
+        ids = fuzzy_ids(model, grams, limit)
+    return ids
+
+def search_records(category, query, limit = None):
+    model, fields = SEARCH_FIELDS[category]
+    limit = limit or app.config['SEARCH_LIMIT']
+    query = (query or '').strip()
+    results = model.query
+    if category == 'doctor':
+        results = results.options(joinedload(Doctor.department))
+
+    if not query:
+        return results.order_by(model.id.asc()).limit(limit).all()
+    if not fts_enabled():
+        return results.filter(model.name.ilike(f'%{query}%')).order_by(model.name.asc()).limit(limit).all()
+    if len(query) < 3:
+        # Too short for trigrams: a capped prefix match on the name
+        return results.filter(model.name.ilike(f'{query}%')).order_by(model.name.asc()).limit(limit).all()
+
+    ids = search_ids(category, query, limit)
+    if not ids:
+        return []
+    rows = {row.id: row for row in results.filter(model.id.in_(ids))}
+    return [rows[id] for id in ids if id in rows]
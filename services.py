@@ -0,0 +1,301 @@
+from models import db, Department, Doctor, Appointment, Doctor_Schedule
+from sqlalchemy import select, insert, update, and_, case
+from sqlalchemy.exc import IntegrityError, OperationalError
+from rollups import transition_appointments, move_status, record_booking, record_reschedule, UPSERTS
+from slots import slot_bit, first_free, iter_slots, SLOT_LABELS, ALL_SLOTS
+from datetime import datetime, timedelta
+
+SCHEDULE_WINDOW_DAYS = 8
+AVAILABILITY_HORIZON_DAYS = 31
+
+class BookingError(Exception):
+    message = 'The booking could not be completed. Please try again.'
+
+class SlotUnavailable(BookingError):
+    message = 'Selected slot is no longer available. Please choose a different slot.'
+
+class AvailabilityError(Exception):
+    message = 'The availability could not be updated. Please try again.'
+
+    def __init__(self, message = None):
+        super().__init__(message or self.message)
+        self.message = message or self.message
+
+class BookedSlotConflict(AvailabilityError):
+    message = 'Slots with a booked appointment cannot be closed.'
+
+    def __init__(self, conflicts):
+        super().__init__()
+        self.conflicts = conflicts
+
+#Set-based maintenance and write operations shared by routes and CLI commands
+def sweep_outdated_entities(today = None):
+    # Only rows still 'Booked' are touched, so running the sweep twice is a no-op
+    today = today or datetime.now().date()
+    missed = transition_appointments('Missed', Appointment.date < today, Appointment.status == 'Booked')
+    removed = Doctor_Schedule.query.filter(Doctor_Schedule.date < today).delete(synchronize_session = False)
+    db.session.commit()
+    return missed, removed
+
+def deactivate_doctors(*criteria, today = None):
+    # Doctors matching criteria go Inactive, their upcoming Booked appointments are cancelled (rollups follow)
+    # and, with no booking left on those days, their upcoming bitmaps are cleared; the caller commits
+    today = today or datetime.now().date()
+    doctor_ids = select(Doctor.id).where(*criteria)
+    doctors = db.session.execute(update(Doctor).where(*criteria, Doctor.status != 'Inactive').values(status = 'Inactive')
+                                 .execution_options(synchronize_session = False)).rowcount
+    appointments = transition_appointments('Cancelled', Appointment.doctor_id.in_(doctor_ids),
+                                           Appointment.status == 'Booked', Appointment.date >= today)
+    schedules = db.session.execute(update(Doctor_Schedule).where(
+        Doctor_Schedule.doctor_id.in_(doctor_ids), Doctor_Schedule.date >= today, Doctor_Schedule.booked_slots != 0
+    ).values(booked_slots = 0).execution_options(synchronize_session = False)).rowcount
+    return {'doctors': doctors, 'appointments': appointments, 'schedules': schedules}
+
+def set_doctor_status(doctor_id, status, today = None):
+    # One transaction; returns how many doctors, appointments and schedule days changed
+    if status == 'Inactive':
+        counts = deactivate_doctors(Doctor.id == doctor_id, today = today)
+    else:
+        doctors = db.session.execute(update(Doctor).where(Doctor.id == doctor_id, Doctor.status != status).values(status = status)
+                                     .execution_options(synchronize_session = False)).rowcount
+        counts = {'doctors': doctors, 'appointments': 0, 'schedules': 0}
+    db.session.commit()
+    return counts
+
+def set_department_status(department_id, status, today = None):
+    # The department's doctors follow its status, in the same transaction
+    db.session.execute(update(Department).where(Department.id == department_id).values(status = status)
+                       .execution_options(synchronize_session = False))
+    if status == 'Inactive':
+        counts = deactivate_doctors(Doctor.department_id == department_id, today = today)
+    else:
+        doctors = db.session.execute(update(Doctor).where(Doctor.department_id == department_id, Doctor.status != status)
+                                     .values(status = status).execution_options(synchronize_session = False)).rowcount
+        counts = {'doctors': doctors, 'appointments': 0, 'schedules': 0}
+    db.session.commit()
+    return counts
+
+def cancel_booking(appointment):
+    # An upcoming booking gives its slot back; the appointment row stays as history
+    if appointment.status == 'Booked' and appointment.date >= datetime.now().date():
+        release_slot(appointment.doctor_id, appointment.date, appointment.slot)
+    move_status(appointment.date, appointment.doctor_id, appointment.status, 'Cancelled')
+    appointment.status = 'Cancelled'
+    db.session.commit()
+
+def insert_missing_schedules(rows):
+    # A concurrent run may create the same doctor-days between our read and this insert: the unique (doctor_id, date)
+    # index makes those rows no-ops, as ON CONFLICT DO NOTHING where the dialect has it and per-row savepoints elsewhere
+    dialect = db.session.get_bind().dialect.name
+    if dialect in UPSERTS:
+        return db.session.execute(UPSERTS[dialect](Doctor_Schedule.__table__).on_conflict_do_nothing(index_elements = ['doctor_id', 'date']), rows).rowcount
+    created = 0
+    for row in rows:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(insert(Doctor_Schedule).values(**row))
+            created += 1
+        except IntegrityError:
+            pass
+    return created
+
+def materialize_schedules(doctor_ids = None, days = SCHEDULE_WINDOW_DAYS, today = None):
+    # One query finds the (doctor_id, date) pairs already present in the window, one executemany fills the gaps;
+    # once the window exists this is a single read and nothing is written
+    today = today or datetime.now().date()
+    window = [today + timedelta(days = i) for i in range(days)]
+    query = db.session.query(Doctor.id, Doctor_Schedule.date).outerjoin(
+        Doctor_Schedule, and_(Doctor_Schedule.doctor_id == Doctor.id, Doctor_Schedule.date >= window[0], Doctor_Schedule.date <= window[-1])
+    ).filter(Doctor.status == 'Active')
+    if doctor_ids is not None:
+        query = query.filter(Doctor.id.in_(doctor_ids))
+
+    existing = {}
+    for doctor_id, date in query:
+        dates = existing.setdefault(doctor_id, set())
+        if date is not None:
+            dates.add(date)
+
+    rows = [{'doctor_id': doctor_id, 'date': date, 'open_slots': 0, 'booked_slots': 0, 'status': True}
+            for doctor_id, dates in existing.items() for date in window if date not in dates]
+    if not rows:
+        return 0
+    created = insert_missing_schedules(rows)
+    db.session.commit()
+    return created
+
+def booked_conflicts(rows, days):
+    # Booked bits the requested masks would close, per date
+    return [{'date': row.date.isoformat(), 'slots': list(iter_slots(row.booked_slots & ~days[row.date]))}
+            for row in rows if row.booked_slots & ~days[row.date]]
+
+def availability_diff(date, before, after):
+    return {'date': date.isoformat(), 'opened': list(iter_slots(after & ~before)), 'closed': list(iter_slots(before & ~after)),
+            'open_slots': list(iter_slots(after))}
+
+def schedule_rows(doctor_id, dates):
+    return db.session.execute(select(Doctor_Schedule.id, Doctor_Schedule.date, Doctor_Schedule.open_slots, Doctor_Schedule.booked_slots)
+                              .where(Doctor_Schedule.doctor_id == doctor_id, Doctor_Schedule.date.in_(dates))).all()
+
+def update_availability(doctor_id, days, today = None):
+    # days maps each date to the complete open-slot mask wanted for it. One read, one CASE-by-id UPDATE and, for days
+    # past the materialized window, one executemany insert, all in a single transaction; returns the per-day diff
+    today = today or datetime.now().date()
+    horizon = today + timedelta(days = AVAILABILITY_HORIZON_DAYS - 1)
+    if any(not today <= date <= horizon for date in days):
+        raise AvailabilityError(f'Dates must fall between {today} and {horizon}.')
+    rows = schedule_rows(doctor_id, list(days))
+    conflicts = booked_conflicts(rows, days)
+    if conflicts:
+        raise BookedSlotConflict(conflicts)
+
+    changed = {row.id: days[row.date] for row in rows if row.open_slots != days[row.date]}
+    diff = [availability_diff(row.date, row.open_slots, days[row.date]) for row in rows if row.id in changed]
+    present = {row.date for row in rows}
+    new_rows = [{'doctor_id': doctor_id, 'date': date, 'open_slots': mask, 'booked_slots': 0, 'status': True}
+                for date, mask in days.items() if date not in present and mask]
+    diff += [availability_diff(row['date'], 0, row['open_slots']) for row in new_rows]
+    try:
+        if changed:
+            # The booked guard is checked again inside the UPDATE, so a booking that lands after the read is never closed
+            result = db.session.execute(
+                update(Doctor_Schedule)
+                .where(Doctor_Schedule.id.in_(list(changed)),
+                       Doctor_Schedule.booked_slots.bitwise_and(case({id: ALL_SLOTS & ~mask for id, mask in changed.items()},
+                                                                     value = Doctor_Schedule.id)) == 0)
+                .values(open_slots = case(changed, value = Doctor_Schedule.id))
+                .execution_options(synchronize_session = False))
+            if result.rowcount != len(changed):
+                db.session.rollback()
+                raise BookedSlotConflict(booked_conflicts(schedule_rows(doctor_id, list(days)), days))
+        if new_rows:
+            db.session.execute(insert(Doctor_Schedule), new_rows)
+        db.session.commit()
+    except (IntegrityError, OperationalError):
+        # IntegrityError: a concurrent request created one of the new days first
+        db.session.rollback()
+        raise AvailabilityError()
+    return sorted(diff, key = lambda day: day['date'])
+
+def claim_slot(doctor_id, schedule_id, slot_number):
+    # Compare-and-set on the bitmap: of any number of concurrent requests only one sees rowcount 1
+    try:
+        bit = slot_bit(slot_number)
+    except ValueError:
+        raise SlotUnavailable()
+    result = db.session.execute(
+        update(Doctor_Schedule)
+        .where(Doctor_Schedule.id == schedule_id, Doctor_Schedule.doctor_id == doctor_id,
+               Doctor_Schedule.date >= datetime.now().date(),
+               Doctor_Schedule.open_slots.bitwise_and(bit) != 0,
+               Doctor_Schedule.booked_slots.bitwise_and(bit) == 0)
+        .values(booked_slots = Doctor_Schedule.booked_slots.bitwise_or(bit))
+        .execution_options(synchronize_session = False))
+    if result.rowcount != 1:
+        raise SlotUnavailable()
+    return db.session.query(Doctor_Schedule.date).filter(Doctor_Schedule.id == schedule_id).scalar()
+
+def release_slot(doctor_id, date, slot_number):
+    db.session.execute(
+        update(Doctor_Schedule)
+        .where(Doctor_Schedule.doctor_id == doctor_id, Doctor_Schedule.date == date)
+        .values(booked_slots = Doctor_Schedule.booked_slots.bitwise_and(~slot_bit(slot_number)))
+        .execution_options(synchronize_session = False))
+
+def free_slots_filter():
+    return Doctor_Schedule.open_slots.bitwise_and(Doctor_Schedule.booked_slots.bitwise_not()) != 0
+
+def next_free_slot(department_id, today = None):
+    # Bitwise scan over plain rows: the first doctor-day with a free bit, no ORM objects loaded
+    today = today or datetime.now().date()
+    row = db.session.query(Doctor_Schedule.id, Doctor_Schedule.doctor_id, Doctor_Schedule.date,
+                           Doctor_Schedule.open_slots, Doctor_Schedule.booked_slots
+    ).join(Doctor, Doctor.id == Doctor_Schedule.doctor_id).filter(
+        Doctor.department_id == department_id, Doctor.status == 'Active',
+        Doctor_Schedule.date >= today, Doctor_Schedule.status.is_(True), free_slots_filter()
+    ).order_by(Doctor_Schedule.date.asc(), Doctor_Schedule.doctor_id.asc()).first()
+    if row is None:
+        return None
+    return {'schedule_id': row.id, 'doctor_id': row.doctor_id, 'date': row.date, 'slot': first_free(row.open_slots, row.booked_slots)}
+
+def earliest_slots_query(department_id, start = None, end = None):
+    start = max(start or datetime.now().date(), datetime.now().date())
+    query = select(Doctor_Schedule.id, Doctor_Schedule.doctor_id, Doctor.name, Doctor_Schedule.date,
+                   Doctor_Schedule.open_slots, Doctor_Schedule.booked_slots
+    ).join(Doctor, Doctor.id == Doctor_Schedule.doctor_id).where(
+        Doctor.department_id == department_id, Doctor.status == 'Active',
+        Doctor_Schedule.date >= start, Doctor_Schedule.status.is_(True), free_slots_filter())
+    if end is not None:
+        query = query.where(Doctor_Schedule.date <= end)
+    return query.order_by(Doctor_Schedule.date.asc(), Doctor_Schedule.doctor_id.asc())
+
+class SlotCollector:
+    # Fed rows in date order; add() returns False once the first date that fills the limit is complete
+    def __init__(self, limit):
+        self.limit = limit
+        self.slots, self.day, self.current = [], [], None
+
+    def add(self, row):
+        if row.date != self.current:
+            self.slots += sorted(self.day, key = lambda slot: (slot['slot'], slot['doctor_id']))
+            self.day, self.current = [], row.date
+            if len(self.slots) >= self.limit:
+                return False
+        for slot_number in iter_slots(row.open_slots & ~row.booked_slots):
+            self.day.append({'schedule_id': row.id, 'doctor_id': row.doctor_id, 'doctor_name': row.name,
+                             'date': row.date.isoformat(), 'slot': slot_number, 'label': SLOT_LABELS[slot_number - 1]})
+        return True
+
+    def result(self):
+        if len(self.slots) < self.limit:
+            self.slots += sorted(self.day, key = lambda slot: (slot['slot'], slot['doctor_id']))
+            self.day = []
+        return self.slots[:self.limit]
+
+def earliest_free_slots(department_id, start = None, end = None, limit = 10):
+    # Rows arrive in date order from one indexed query; the scan stops at the end of the first date that fills the limit
+    collector = SlotCollector(limit)
+    for row in db.session.execute(earliest_slots_query(department_id, start, end).execution_options(yield_per = 200)):
+        if not collector.add(row):
+            break
+    return collector.result()
+
+def book_slot(patient_id, doctor_id, schedule_id, slot_number, visit_type):
+    # Claiming the slot and inserting the appointment commit together or not at all
+    try:
+        date = claim_slot(doctor_id, schedule_id, slot_number)
+        appointment = Appointment(patient_id = patient_id, doctor_id = doctor_id, visit_type = visit_type, date = date, slot = slot_number, status = 'Booked')
+        db.session.add(appointment)
+        record_booking(appointment)
+        db.session.commit()
+        return appointment
+    except SlotUnavailable:
+        db.session.rollback()
+        raise
+    except IntegrityError:
+        db.session.rollback()
+        raise SlotUnavailable()
+    except OperationalError:
+        db.session.rollback()
+        raise BookingError()
+
+def reschedule_slot(appointment, schedule_id, slot_number):
+    old_date, old_slot = appointment.date, appointment.slot
+    try:
+        date = claim_slot(appointment.doctor_id, schedule_id, slot_number)
+        appointment.date = date
+        appointment.slot = slot_number
+        appointment.status = 'Booked'
+        db.session.flush()
+        release_slot(appointment.doctor_id, old_date, old_slot)
+        record_reschedule(appointment.doctor_id, 'Booked', old_date, date)
+        db.session.commit()
+    except SlotUnavailable:
+        db.session.rollback()
+        raise
+    except IntegrityError:
+        db.session.rollback()
+        raise SlotUnavailable()
+    except OperationalError:
+        db.session.rollback()
+        raise BookingError()
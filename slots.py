@@ -0,0 +1,67 @@
+from app import app
+from datetime import datetime, timedelta
+
+#A doctor-day's slots are stored as integer bitmasks: bit (n - 1) stands for slot n
+LEGACY_LABELS = ['08:00 AM - 12:00 PM', '01:00 PM - 05:00 PM']
+MAX_SLOTS = 62
+
+def slot_labels():
+    # Without SLOT_MINUTES the day keeps its two sessions; otherwise it is cut into a fixed grid
+    minutes = app.config['SLOT_MINUTES']
+    if not minutes:
+        return LEGACY_LABELS
+    start = datetime.strptime(app.config['DAY_START'], '%H:%M')
+    count = app.config['DAY_HOURS'] * 60 // minutes
+    if count > MAX_SLOTS:
+        raise ValueError(f'A day can hold at most {MAX_SLOTS} slots, got {count}.')
+    labels = []
+    for i in range(count):
+        begin = start + timedelta(minutes = i * minutes)
+        end = begin + timedelta(minutes = minutes)
+        labels.append(f"{begin.strftime('%I:%M %p')} - {end.strftime('%I:%M %p')}")
+    return labels
+
+SLOT_LABELS = slot_labels()
+SLOT_COUNT = len(SLOT_LABELS)
+ALL_SLOTS = (1 << SLOT_COUNT) - 1
+
+def slot_bit(slot_number):
+    if not 1 <= slot_number <= SLOT_COUNT:
+        raise ValueError(f'Slot {slot_number} is outside 1..{SLOT_COUNT}.')
+    return 1 << (slot_number - 1)
+
+def set_slot(mask, slot_number):
+    return mask | slot_bit(slot_number)
+
+def clear_slot(mask, slot_number):
+    return mask & ~slot_bit(slot_number)
+
+def has_slot(mask, slot_number):
+    return bool(mask & slot_bit(slot_number))
+
+def slots_mask(slot_numbers):
+    mask = 0
+    for slot_number in slot_numbers:
+        mask |= slot_bit(slot_number)
+    return mask
+
+def iter_slots(mask):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length()
+        mask ^= low
+
+def first_free(open_slots, booked_slots = 0):
+    free = open_slots & ~booked_slots
+    if not free:
+        return None
+    return (free & -free).bit_length()
+
+def popcount(column):
+    # SQL expression counting the set bits of a slot bitmap column (SQLite has no popcount)
+    expression = column.bitwise_and(1)
+    for i in range(1, SLOT_COUNT):
+        expression = expression + column.bitwise_rshift(i).bitwise_and(1)
+    return expression
+
+app.jinja_env.globals['slot_labels'] = SLOT_LABELS
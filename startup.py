@@ -0,0 +1,46 @@
+from app import app
+from models import create_schema, seed_admin
+from search import create_search_index
+from rollups import reconcile_rollups
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy.orm import configure_mappers
+import os
+
+#Process start-up: the database set-up behind `flask init-db` and the warm-up that spares the first requests
+def init_database():
+    # Schema and migrations, search indexes, rollups of older databases and the default admin; safe to re-run
+    create_schema()
+    create_search_index()
+    return {'rollups_rebuilt': reconcile_rollups(), 'admin_created': seed_admin()}
+
+def use_bytecode_cache(directory):
+    os.makedirs(directory, exist_ok = True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+
+def load_templates():
+    # Parses and compiles every template, or with a warm bytecode cache only unmarshals it
+    names = app.jinja_env.list_templates()
+    for name in names:
+        app.jinja_env.get_template(name)
+    return names
+
+def precompile_templates(directory):
+    # Build step: fills the bytecode cache that processes started with TEMPLATE_CACHE_DIR load from
+    use_bytecode_cache(directory)
+    app.jinja_env.cache.clear()
+    return load_templates()
+
+def warm_up():
+    configure_mappers()
+    load_templates()
+
+if app.config['TEMPLATE_CACHE_DIR']:
+    use_bytecode_cache(app.config['TEMPLATE_CACHE_DIR'])
+
+# Off by default: a process only connects on its first query, and `flask init-db` (or `python app.py`) sets the database up
+if app.config['AUTO_INIT_DB']:
+    with app.app_context():
+        init_database()
+
+if app.config['STARTUP_WARM']:
+    warm_up()
@@ -0,0 +1,61 @@
+from app import app
+from cache import TTLCache
+from models import db, Department, Doctor, Patient, Doctor_Schedule, Appointment_Rollup, Department_Rollup
+from slots import popcount
+from sqlalchemy import func
+from datetime import datetime, timedelta
+
+#Admin statistics read from the rollup tables and refreshed every STATS_TTL seconds
+STATS_DAYS = 7
+TOP_DOCTORS = 10
+stats_cache = TTLCache(app.config['STATS_TTL'])
+
+def appointments_by_status():
+    rows = db.session.query(Appointment_Rollup.status, func.sum(Appointment_Rollup.total)).group_by(Appointment_Rollup.status)
+    return {status: total for status, total in rows if total}
+
+def appointments_by_date(today):
+    rows = db.session.query(Appointment_Rollup.date, func.sum(Appointment_Rollup.total)).filter(
+        Appointment_Rollup.date.between(today - timedelta(days = STATS_DAYS), today + timedelta(days = STATS_DAYS))
+    ).group_by(Appointment_Rollup.date).order_by(Appointment_Rollup.date.asc())
+    return [(date.isoformat(), total) for date, total in rows if total]
+
+def appointments_by_department():
+    total = func.sum(Department_Rollup.bookings)
+    rows = db.session.query(Department.name, total).join(
+        Department_Rollup, Department_Rollup.department_id == Department.id
+    ).group_by(Department.id).order_by(total.desc())
+    return [(name, bookings) for name, bookings in rows if bookings]
+
+def doctor_utilization(today):
+    # Booked vs offered slots over the upcoming schedule window, busiest doctors first
+    booked = func.sum(popcount(Doctor_Schedule.booked_slots))
+    offered = func.sum(popcount(Doctor_Schedule.open_slots.bitwise_or(Doctor_Schedule.booked_slots)))
+    rows = db.session.query(Doctor.id, Doctor.name, booked, offered).join(
+        Doctor_Schedule, Doctor_Schedule.doctor_id == Doctor.id
+    ).filter(Doctor.status == 'Active', Doctor_Schedule.date >= today).group_by(Doctor.id).order_by(
+        (booked * 1.0 / func.nullif(offered, 0)).desc().nulls_last(), Doctor.id.asc()
+    ).limit(TOP_DOCTORS)
+    return [{'id': id, 'name': name, 'booked': booked or 0, 'offered': offered or 0,
+             'utilization': round(100.0 * (booked or 0) / offered) if offered else 0} for id, name, booked, offered in rows]
+
+def patients_by_status():
+    rows = db.session.query(Patient.status, func.count()).group_by(Patient.status)
+    return dict(rows)
+
+def compute_statistics():
+    today = datetime.now().date()
+    by_status = appointments_by_status()
+    patients = patients_by_status()
+    return {
+        'appointments_total': sum(by_status.values()),
+        'appointments_by_status': by_status,
+        'appointments_by_date': appointments_by_date(today),
+        'appointments_by_department': appointments_by_department(),
+        'doctor_utilization': doctor_utilization(today),
+        'patients_total': sum(patients.values()),
+        'patients_by_status': patients,
+    }
+
+def admin_statistics():
+    return stats_cache.get(('admin_stats',), compute_statistics)
@@ -0,0 +1,114 @@
+from models import db, Department, Doctor, Patient, Appointment, Doctor_Schedule, Treatment
+from services import SCHEDULE_WINDOW_DAYS
+from rollups import rebuild_rollups
+from fragments import bump_versions
+from passwords import hash_password
+from slots import SLOT_COUNT, ALL_SLOTS, slot_bit
+from sqlalchemy import insert, func
+from datetime import datetime, timedelta
+from itertools import count, batched
+import random
+
+#Synthetic data generator for benchmarks; every generated user shares SYNTHETIC_PASSWORD
+SYNTHETIC_PASSWORD = 'password'
+BATCH_ROWS = 10000
+FILL_RATE = 0.8
+PAST_STATUSES = (('Completed', 70), ('Missed', 10), ('Cancelled', 20))
+FUTURE_STATUSES = (('Booked', 90), ('Cancelled', 10))
+VISIT_TYPES = ('In-Person', 'Virtual')
+FIRST_NAMES = ('Asha', 'Ravi', 'Meera', 'Arjun', 'Kavya', 'Vikram', 'Nisha', 'Rahul', 'Priya', 'Sanjay', 'Anita', 'Karan')
+LAST_NAMES = ('Sharma', 'Iyer', 'Patel', 'Reddy', 'Gupta', 'Nair', 'Singh', 'Das', 'Menon', 'Rao', 'Joshi', 'Kapoor')
+
+def next_id(model):
+    return (db.session.query(func.max(model.id)).scalar() or 0) + 1
+
+def insert_rows(model, rows):
+    # Core executemany in fixed-size batches keeps memory flat at any scale
+    total = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_ROWS:
+            db.session.execute(insert(model), batch)
+            db.session.commit()
+            total += len(batch)
+            batch = []
+    if batch:
+        db.session.execute(insert(model), batch)
+        db.session.commit()
+        total += len(batch)
+    return total
+
+def person_name(rng):
+    return f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+
+def pick_status(rng, choices):
+    return rng.choices([status for status, weight in choices], [weight for status, weight in choices])[0]
+
+def appointment_rows(rng, first_id, doctor_ids, patient_ids, total, today, booked):
+    # Walks backwards from the end of the schedule window, filling FILL_RATE of each (doctor, day, slot),
+    # so the (doctor_id, slot, date) constraint holds and future days keep free slots for booking
+    id = first_id
+    day = today + timedelta(days = SCHEDULE_WINDOW_DAYS - 1)
+    while total > 0:
+        statuses = FUTURE_STATUSES if day >= today else PAST_STATUSES
+        for doctor_id in doctor_ids:
+            for slot in range(1, SLOT_COUNT + 1):
+                if total == 0 or rng.random() > FILL_RATE:
+                    continue
+                status = pick_status(rng, statuses)
+                if status == 'Booked':
+                    booked[(doctor_id, day)] = booked.get((doctor_id, day), 0) | slot_bit(slot)
+                yield {'id': id, 'patient_id': rng.choice(patient_ids), 'doctor_id': doctor_id, 'date': day, 'slot': slot,
+                       'status': status, 'visit_type': rng.choice(VISIT_TYPES)}
+                id += 1
+                total -= 1
+        day -= timedelta(days = 1)
+
+def generate(departments = 20, doctors = 1000, patients = 1000000, appointments = 10000000, seed = 1, progress = print):
+    rng = random.Random(seed)
+    if not doctors or not patients:
+        appointments = 0
+    today = datetime.now().date()
+    passhash = hash_password(SYNTHETIC_PASSWORD)
+
+    first = next_id(Department)
+    department_ids = list(range(first, first + departments))
+    insert_rows(Department, ({'id': id, 'name': f'Department {id}', 'description': f'Synthetic department {id}'} for id in department_ids))
+    progress(f'{departments} departments')
+
+    first = next_id(Doctor)
+    doctor_ids = list(range(first, first + doctors))
+    insert_rows(Doctor, ({'id': id, 'username': f'doctor_{id}', 'passhash': passhash, 'name': f'Dr. {person_name(rng)}', 'address': 'Synthetic address',
+                          'contact': f'9{id:09d}', 'department_id': rng.choice(department_ids) if department_ids else None, 'description': 'Synthetic doctor'} for id in doctor_ids))
+    progress(f'{doctors} doctors')
+
+    first = next_id(Patient)
+    patient_ids = range(first, first + patients)
+    insert_rows(Patient, ({'id': id, 'username': f'patient_{id}', 'passhash': passhash, 'name': person_name(rng), 'address': 'Synthetic address',
+                           'contact': f'8{id:09d}'} for id in patient_ids))
+    progress(f'{patients} patients')
+
+    # Each batch of appointments is committed together with the treatments of its Completed rows
+    booked = {}
+    treatment_ids = count(next_id(Treatment))
+    created = 0
+    for batch in batched(appointment_rows(rng, next_id(Appointment), doctor_ids, patient_ids, appointments, today, booked), BATCH_ROWS):
+        db.session.execute(insert(Appointment), batch)
+        treatments = [{'id': next(treatment_ids), 'appointment_id': row['id'], 'patient_id': row['patient_id'], 'doctor_id': row['doctor_id'],
+                       'diagnosis': 'Synthetic diagnosis', 'treatment': 'Synthetic treatment', 'instruction': 'Synthetic instruction'}
+                      for row in batch if row['status'] == 'Completed']
+        if treatments:
+            db.session.execute(insert(Treatment), treatments)
+        db.session.commit()
+        created += len(batch)
+    progress(f'{created} appointments')
+
+    window = [today + timedelta(days = i) for i in range(SCHEDULE_WINDOW_DAYS)]
+    insert_rows(Doctor_Schedule, ({'doctor_id': doctor_id, 'date': date, 'open_slots': ALL_SLOTS, 'booked_slots': booked.get((doctor_id, date), 0),
+                                   'status': True} for doctor_id in doctor_ids for date in window))
+    progress(f'{doctors * len(window)} schedules')
+
+    rebuild_rollups()
+    progress('rollups rebuilt')
+    bump_versions('departments', 'doctors')
@@ -0,0 +1,51 @@
+import os, sys, tempfile
+
+#Test set-up: the app reads its configuration at import, so a scratch SQLite file is configured before anything imports it
+DATABASE_DIR = tempfile.mkdtemp(prefix = 'hms-tests-')
+os.environ['SECRET_KEY'] = 'test'
+os.environ['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.join(DATABASE_DIR, "hms.db")}'
+os.environ['AUTO_INIT_DB'] = 'false'
+os.environ['STARTUP_WARM'] = 'false'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from contextlib import contextmanager
+from sqlalchemy import event
+from app import app
+from models import db
+from startup import init_database
+
+@pytest.fixture(scope = 'session', autouse = True)
+def database():
+    with app.app_context():
+        init_database()
+    yield
+    with app.app_context():
+        db.engine.dispose()
+
+@pytest.fixture
+def app_context():
+    with app.app_context():
+        yield
+
+def signed_in(role, user):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['role'] = role
+        session['user_id'] = user.id
+        session['username'] = user.username
+    return client
+
+@contextmanager
+def count_statements():
+    # Every statement sent to the primary while the block runs
+    statements = []
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
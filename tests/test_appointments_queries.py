@@ -0,0 +1,57 @@
+import pytest
+from datetime import date, timedelta
+from itertools import count
+from conftest import signed_in, count_statements
+from models import db, Admin, Department, Doctor, Patient, Appointment, Treatment
+
+#The appointment listings load doctor, department, patient and treatment with the appointments, whatever the row count
+serial = count(1)
+
+@pytest.fixture
+def people(app_context):
+    n = next(serial)
+    department = Department(name = f'Listing department {n}', description = 'Listing tests')
+    db.session.add(department)
+    db.session.flush()
+    doctor = Doctor(username = f'listing_doctor_{n}', passhash = '-', name = f'Dr. Listing {n}', address = 'Address', contact = '0',
+                    department_id = department.id, description = 'Listing tests')
+    patients = [Patient(username = f'listing_patient_{n}_{i}', passhash = '-', name = f'Listing Patient {i}', address = 'Address', contact = '0')
+                for i in range(2)]
+    db.session.add_all([doctor, *patients])
+    db.session.commit()
+    return Admin.query.first(), doctor, patients
+
+def add_appointments(doctor, patients, total, start):
+    # Completed past appointments with their treatments, so every relation the template walks is present
+    for i in range(start, start + total):
+        patient = patients[i % len(patients)]
+        appointment = Appointment(patient_id = patient.id, doctor_id = doctor.id, date = date.today() - timedelta(days = 1 + i), slot = 1,
+                                  status = 'Completed', visit_type = 'In-Person')
+        db.session.add(appointment)
+        db.session.flush()
+        db.session.add(Treatment(appointment_id = appointment.id, patient_id = patient.id, doctor_id = doctor.id,
+                                 diagnosis = 'Diagnosis', treatment = 'Treatment', instruction = 'Instruction'))
+    db.session.commit()
+
+def statements_for(client, url):
+    # Statements sent for one listing, and the rows it rendered (one slot cell each)
+    client.get(url)  # signs the user in to the identity cache
+    with count_statements() as statements:
+        response = client.get(url)
+    assert response.status_code == 200
+    return len(statements), response.get_data(as_text = True).count('<td>Slot ')
+
+@pytest.mark.parametrize('view', ['doctor', 'patient'])
+def test_statement_count_does_not_grow_with_rows(people, view):
+    admin, doctor, patients = people
+    client = signed_in('admin', admin)
+    url = f'/doctor/{doctor.id}/appointments?limit=100' if view == 'doctor' else f'/patient/{patients[0].id}/appointments?limit=100'
+
+    add_appointments(doctor, patients, 4, 0)
+    few, few_rows = statements_for(client, url)
+    add_appointments(doctor, patients, 80, 4)
+    many, many_rows = statements_for(client, url)
+
+    assert many_rows > few_rows > 0
+    assert few == many
+    assert many <= 2
@@ -0,0 +1,62 @@
+import threading
+from collections import Counter
+from datetime import date, timedelta
+from conftest import signed_in
+from models import db, Department, Doctor, Patient, Appointment, Doctor_Schedule
+from slots import SLOT_COUNT, ALL_SLOTS, slot_bit
+
+#Many patients racing for the same few slots: every post is answered with a redirect and no slot is booked twice
+THREADS = 16
+POSTS = 10
+DAYS = 3
+
+def test_concurrent_bookings_never_double_book(app_context):
+    department = Department(name = 'Booking race department', description = 'Booking tests')
+    db.session.add(department)
+    db.session.flush()
+    doctor = Doctor(username = 'booking_race_doctor', passhash = '-', name = 'Dr. Race', address = 'Address', contact = '0',
+                    department_id = department.id, description = 'Booking tests')
+    patients = [Patient(username = f'booking_race_patient_{i}', passhash = '-', name = f'Race Patient {i}', address = 'Address', contact = '0')
+                for i in range(THREADS)]
+    db.session.add_all([doctor, *patients])
+    db.session.flush()
+    schedules = [Doctor_Schedule(doctor_id = doctor.id, date = date.today() + timedelta(days = day), open_slots = ALL_SLOTS, booked_slots = 0)
+                 for day in range(1, DAYS + 1)]
+    db.session.add_all(schedules)
+    db.session.commit()
+    targets = [f'{schedule.id}_{slot}' for schedule in schedules for slot in range(1, SLOT_COUNT + 1)]
+    clients = [signed_in('patient', patient) for patient in patients]
+    doctor_id, patient_ids = doctor.id, [patient.id for patient in patients]
+    db.session.remove()
+
+    barrier = threading.Barrier(THREADS)
+    statuses = Counter()
+    lock = threading.Lock()
+
+    def book(i):
+        # Each thread starts on a different slot and walks round all of them, so every slot is contested
+        barrier.wait()
+        for n in range(POSTS):
+            response = clients[i].post(f'/appointment/book/{doctor_id}', data = {
+                'patient_id': patient_ids[i], 'selected_slot': targets[(i + n) % len(targets)], 'visit_type': 'In-Person'})
+            with lock:
+                statuses[response.status_code] += 1
+
+    threads = [threading.Thread(target = book, args = (i,)) for i in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert statuses == {302: THREADS * POSTS}
+
+    booked = Appointment.query.filter(Appointment.doctor_id == doctor_id, Appointment.status != 'Cancelled').all()
+    taken = Counter((appointment.date, appointment.slot) for appointment in booked)
+    assert all(total == 1 for total in taken.values())
+    assert len(taken) == len(targets)
+    for schedule in Doctor_Schedule.query.filter_by(doctor_id = doctor_id):
+        expected = 0
+        for appointment_date, slot in taken:
+            if appointment_date == schedule.date:
+                expected |= slot_bit(slot)
+        assert schedule.booked_slots == expected
@@ -0,0 +1,50 @@
+import threading
+import passwords
+from concurrent.futures import ThreadPoolExecutor
+from app import app
+from models import db, Patient
+from passwords import hash_password, needs_rehash, hash_pool
+
+#Password hashing runs on a bounded pool; a login storm must leave request threads for everyone else
+def test_login_storm_leaves_threads_for_other_requests(app_context, monkeypatch):
+    patient = Patient(username = 'storm_patient', passhash = hash_password('password'), name = 'Storm Patient', address = 'Address', contact = '0')
+    db.session.add(patient)
+    db.session.commit()
+    db.session.remove()
+
+    # Every verification waits until released, as if the hash workers were saturated
+    release = threading.Event()
+    check_password_hash = passwords.check_password_hash
+    def slow_check(passhash, password):
+        release.wait(30)
+        return check_password_hash(passhash, password)
+    monkeypatch.setattr(passwords, 'check_password_hash', slow_check)
+
+    def login():
+        return app.test_client().post('/login/patient', data = {'username': 'storm_patient', 'password': 'password'})
+
+    # The same number of request threads as the ASGI server runs
+    threads = app.config['ASGI_THREADS']
+    with ThreadPoolExecutor(max_workers = threads) as executor:
+        try:
+            logins = [executor.submit(login) for _ in range(2 * threads)]
+            home = executor.submit(lambda: app.test_client().get('/home'))
+            assert home.result(timeout = 10).status_code == 200
+        finally:
+            release.set()
+        locations = [future.result(timeout = 30).location for future in logins]
+
+    assert hash_pool.limit <= threads - hash_pool.workers
+    # Logins past the queue limit are sent back to the login page at once instead of holding a thread
+    assert sum(location.endswith('/patient_dashboard') for location in locations) == hash_pool.limit
+    assert sum(location.endswith('/login/patient') for location in locations) == 2 * threads - hash_pool.limit
+
+def test_rehash_when_salt_length_changes(monkeypatch):
+    passhash = hash_password('password')
+    assert not needs_rehash(passhash)
+    monkeypatch.setitem(app.config, 'PASSWORD_SALT_LENGTH', app.config['PASSWORD_SALT_LENGTH'] + 8)
+    assert needs_rehash(passhash)
+
+def test_rehash_when_method_changes():
+    assert needs_rehash('pbkdf2:sha256:1000$' + 'a' * app.config['PASSWORD_SALT_LENGTH'] + '$00')
+    assert needs_rehash('not a werkzeug hash')
@@ -0,0 +1,38 @@
+from datetime import date, timedelta
+from conftest import signed_in
+from models import db, Department, Doctor, Patient, Appointment, Department_Rollup
+from rollups import record_booking, rebuild_rollups
+
+#The write paths and rebuild_rollups() must agree on every department's bookings
+def department_bookings(department_ids):
+    rows = Department_Rollup.query.filter(Department_Rollup.department_id.in_(department_ids), Department_Rollup.bookings != 0)
+    return {(row.department_id, row.date): row.bookings for row in rows}
+
+def test_department_change_matches_rebuild(app_context):
+    departments = [Department(name = f'Rollup department {n}', description = 'Rollup tests') for n in range(2)]
+    db.session.add_all(departments)
+    db.session.flush()
+    doctor = Doctor(username = 'rollup_doctor', passhash = '-', name = 'Dr. Rollup', address = 'Address', contact = '0',
+                    department_id = departments[0].id, description = 'Rollup tests')
+    patient = Patient(username = 'rollup_patient', passhash = '-', name = 'Rollup Patient', address = 'Address', contact = '0')
+    db.session.add_all([doctor, patient])
+    db.session.flush()
+    for i in range(5):
+        appointment = Appointment(patient_id = patient.id, doctor_id = doctor.id, date = date.today() + timedelta(days = i % 3),
+                                  slot = 1 + i // 3, status = 'Booked')
+        db.session.add(appointment)
+        record_booking(appointment)
+    db.session.commit()
+    department_ids = [department.id for department in departments]
+
+    response = signed_in('doctor', doctor).post(f'/profile/edit/doctor/{doctor.id}', data = {
+        'username': doctor.username, 'name': doctor.name, 'address': doctor.address, 'contact': doctor.contact,
+        'department_id': department_ids[1], 'description': doctor.description})
+    assert response.status_code == 302
+    db.session.expire_all()
+    assert doctor.department_id == department_ids[1]
+
+    incremental = department_bookings(department_ids)
+    rebuild_rollups()
+    assert incremental == department_bookings(department_ids)
+    assert sum(incremental.values()) == 5 and all(department_id == department_ids[1] for department_id, _ in incremental)
@@ -0,0 +1,100 @@
+import pytest, threading
+from datetime import date, timedelta
+from itertools import count
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+from conftest import count_statements, signed_in
+from app import app
+from models import db, Department, Doctor, Doctor_Schedule, create_schema
+from services import materialize_schedules, SCHEDULE_WINDOW_DAYS, AVAILABILITY_HORIZON_DAYS
+from slots import ALL_SLOTS, SLOT_COUNT
+
+#Doctor-day schedules: one row per (doctor_id, date)
+serial = count(1)
+
+def add_doctor():
+    n = next(serial)
+    department = Department(name = f'Schedule department {n}', description = 'Schedule tests')
+    db.session.add(department)
+    db.session.flush()
+    doctor = Doctor(username = f'schedule_doctor_{n}', passhash = '-', name = f'Dr. Schedule {n}', address = 'Address', contact = '0',
+                    department_id = department.id, description = 'Schedule tests')
+    db.session.add(doctor)
+    db.session.commit()
+    return doctor
+
+@pytest.fixture
+def doctor(app_context):
+    return add_doctor()
+
+def test_migration_merges_duplicate_days(doctor):
+    # A database from before the unique index, holding the same doctor-day three times
+    with db.engine.begin() as conn:
+        conn.execute(text('DROP INDEX "ix_doctor_schedule_doctor_date"'))
+        conn.execute(text('CREATE INDEX "ix_doctor_schedule_doctor_date" ON "Doctor_Schedule" (doctor_id, date)'))
+    day = date.today() + timedelta(days = 1)
+    db.session.add_all([Doctor_Schedule(doctor_id = doctor.id, date = day, open_slots = 1, booked_slots = 0),
+                        Doctor_Schedule(doctor_id = doctor.id, date = day, open_slots = 2, booked_slots = 2),
+                        Doctor_Schedule(doctor_id = doctor.id, date = day, open_slots = 0, booked_slots = 0),
+                        Doctor_Schedule(doctor_id = doctor.id, date = day + timedelta(days = 1), open_slots = 1, booked_slots = 0)])
+    db.session.commit()
+
+    create_schema()
+
+    rows = Doctor_Schedule.query.filter_by(doctor_id = doctor.id).order_by(Doctor_Schedule.date).all()
+    assert [(row.date, row.open_slots, row.booked_slots) for row in rows] == [(day, 3, 2), (day + timedelta(days = 1), 1, 0)]
+    db.session.add(Doctor_Schedule(doctor_id = doctor.id, date = day, open_slots = 0, booked_slots = 0))
+    with pytest.raises(IntegrityError):
+        db.session.commit()
+    db.session.rollback()
+
+def test_concurrent_materialize_creates_each_day_once(app_context):
+    doctor_ids = [add_doctor().id for _ in range(5)]
+    db.session.remove()
+    barrier = threading.Barrier(8)
+    created = []
+
+    def materialize():
+        barrier.wait()
+        with app.app_context():
+            created.append(materialize_schedules(doctor_ids))
+
+    threads = [threading.Thread(target = materialize) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(created) == 8
+    assert sum(created) == len(doctor_ids) * SCHEDULE_WINDOW_DAYS
+    rows = Doctor_Schedule.query.filter(Doctor_Schedule.doctor_id.in_(doctor_ids)).all()
+    assert len(rows) == len({(row.doctor_id, row.date) for row in rows}) == len(doctor_ids) * SCHEDULE_WINDOW_DAYS
+
+def test_materialize_is_read_only_once_the_window_exists(doctor):
+    materialize_schedules([doctor.id])
+    with count_statements() as statements:
+        assert materialize_schedules([doctor.id]) == 0
+    assert all(statement.lstrip().upper().startswith('SELECT') for statement in statements)
+
+def test_availability_form_saves_with_days_past_the_horizon(doctor):
+    # Schedules materialized further ahead than update_availability() accepts must not block the form
+    materialize_schedules([doctor.id], days = AVAILABILITY_HORIZON_DAYS + 14)
+    schedules = Doctor_Schedule.query.filter_by(doctor_id = doctor.id).order_by(Doctor_Schedule.date).all()
+    assert len(schedules) == AVAILABILITY_HORIZON_DAYS + 14
+    client = signed_in('doctor', doctor)
+
+    page = client.get(f'/doctor_id={doctor.id}/availability').get_data(as_text = True)
+    assert f'slot1-{schedules[AVAILABILITY_HORIZON_DAYS - 1].id}' in page
+    assert f'slot1-{schedules[AVAILABILITY_HORIZON_DAYS].id}' not in page
+
+    form = {f'slot{n}-{schedule.id}': 'on' for schedule in schedules for n in range(1, SLOT_COUNT + 1)}
+    response = client.post(f'/doctor_id={doctor.id}/availability', data = form)
+    assert response.status_code == 302 and response.location.endswith('/doctor_dashboard')
+    db.session.expire_all()
+    open_slots = [schedule.open_slots for schedule in Doctor_Schedule.query.filter_by(doctor_id = doctor.id).order_by(Doctor_Schedule.date)]
+    assert open_slots == [ALL_SLOTS] * AVAILABILITY_HORIZON_DAYS + [0] * 14
+
+def test_schedules_command_stays_within_the_horizon(app_context):
+    result = app.test_cli_runner().invoke(args = ['schedules', '--days', str(AVAILABILITY_HORIZON_DAYS + 1)])
+    assert result.exit_code == 2
+    assert '--days' in result.output